@@ -1,3 +1,7 @@
+from heapq import heappush, heappop
+from itertools import count
+from math import ceil
+
 from TemporalDict import TemporalDict
 
 class EndLoopException(StopIteration):
@@ -22,18 +26,100 @@ def wait(time):
 def time():
     return get_current_context().time
 
-waiting_funcs = set()
+#loops running in the background, in the order they were started
+waiting_funcs = {}
 
 def get_waiting_funcs():
     global waiting_funcs
-    return frozenset(waiting_funcs)
+    return tuple(waiting_funcs)
+
+def iterations_before(start, period, target):
+    '''Number of iterations of a loop starting at start, one every period ms, that begin before target'''
+
+    iterations = max(ceil((target - start) / period), 0)
+
+    #rounding may be one off either way
+    while iterations > 0 and start + (iterations - 1) * period >= target:
+        iterations -= 1
+
+    while start + iterations * period < target:
+        iterations += 1
+
+    return iterations
+
+class Scheduler:
+    '''Discrete event scheduler for background loops.
+
+    Every running background loop sits in a heap keyed by the time of its next iteration, loops waking
+    at the same time run in the order they were scheduled. Advancing to a time runs the earliest iteration
+    of any loop until none wakes before that time, so concurrent loops are interleaved in time order and
+    each iteration costs one heap operation. Deterministic loops cover every iteration up to the target in
+    one step, see Loopable.repeat.
+
+    Loops advanced this way keep their events pending until they are stopped themselves, see Loopable.commit.'''
+
+    def __init__(self):
+        self.queue = []
+        self.order = count()
+
+    def schedule(self, loopable):
+        #entries from an earlier schedule of the same loop are skipped when they come up
+        loopable.generation = next(self.order)
+        heappush(self.queue, (loopable.time, loopable.generation, loopable))
+
+    def unschedule(self, loopable):
+        loopable.generation = None
+
+    def advance(self, target):
+        '''Runs every scheduled iteration that starts before target, earliest first'''
+
+        queue = self.queue
+
+        while len(queue) != 0 and queue[0][0] < target:
+            _, generation, loopable = heappop(queue)
+
+            if generation != loopable.generation:
+                continue
+
+            if loopable.step(target):
+                heappush(queue, (loopable.time, generation, loopable))
+
+scheduler = Scheduler()
+
+class Recording:
+    '''Stands in for both the model and the current context while one iteration of a loop is recorded'''
+
+    def __init__(self):
+        self.time = 0
+        self.events = []
+
+    def add_option(self, setting, option):
+        self.events.append((self.time, setting, option))
+
+    @property
+    def periodic(self):
+        '''Whether the events can repeat every self.time ms, starting in order within one period'''
+
+        offsets = [offset for offset, _, _ in self.events]
+
+        return self.time > 0 and len(offsets) != 0 and offsets == sorted(offsets) and 0 <= offsets[0] and offsets[-1] < self.time
 
 class Loopable():
-    def __init__(self, func):
+    def __init__(self, func, deterministic=False):
         self.func = func
         self.time = 0
         self.needs_eval = False
 
+        #True, or a function saying so before each run, when every iteration only calls set_state and wait, the same way each time
+        self.deterministic = deterministic
+
+        #background state, see Scheduler
+        self.cycles = 0
+        self.generation = None
+
+        #(start, period, count, events) of iterations run ahead of this loop's stop, period is None for a single iteration
+        self.pending = []
+
     def __call__(self, *args, **kwargs):
         return self.func(*args, **kwargs)
 
@@ -66,11 +152,124 @@ class Loopable():
         self.num = num
         self.args = args
         self.kwargs = kwargs
+        self.cycles = 0
+        self.pending = []
 
-        waiting_funcs.add(self)
+        waiting_funcs[self] = None
+        scheduler.schedule(self)
 
         return self
 
+    def is_deterministic(self):
+        return self.deterministic() if callable(self.deterministic) else self.deterministic
+
+    def record(self):
+        '''Runs one iteration against a Recording instead of the model, nothing is added to the timeline'''
+        global _model
+
+        model, previous_context = _model, get_current_context()
+
+        recording = Recording()
+        _model = recording
+        set_current_context(recording)
+
+        try:
+            self.func(*self.args, **self.kwargs)
+        finally:
+            _model = model
+            set_current_context(previous_context)
+
+        return recording
+
+    def repeat(self, recording, target):
+        '''Covers every iteration that starts before target with one pending periodic run'''
+
+        period, events = recording.time, recording.events
+
+        iterations = max(iterations_before(self.time, period, target), 1)
+
+        if self.num is not None:
+            iterations = min(iterations, self.num - self.cycles)
+
+        run = self.pending[-1] if len(self.pending) != 0 else None
+
+        #a run advanced again carries on the previous one, its times stay relative to where it started
+        if run is not None and run[1] == period and run[3] == events and run[0] + run[2] * period == self.time:
+            start, iterations_so_far = run[0], run[2]
+            self.pending[-1] = (start, period, iterations_so_far + iterations, events)
+        else:
+            start, iterations_so_far = self.time, 0
+            self.pending.append((start, period, iterations, events))
+
+        self.time = start + (iterations_so_far + iterations) * period
+        self.cycles += iterations
+
+    def step(self, target):
+        '''Runs background iterations in this loop's own context, False once the loop has finished.
+
+        Deterministic loops are recorded once and cover every iteration before target, others run a single iteration.'''
+
+        if self.num is not None and self.cycles >= self.num:
+            return False
+
+        if self.is_deterministic():
+            recording = self.record()
+
+            if recording.periodic:
+                self.repeat(recording, target)
+                return True
+
+        #swap out the context, and keep the iteration's events pending
+        previous_context = get_current_context()
+        set_current_context(self)
+
+        model = get_model()
+        previous_journal = model.journal
+        events = model.journal = []
+
+        self.pending.append((self.time, None, 1, events))
+
+        try:
+            self.func(*self.args, **self.kwargs)
+        except EndLoopException:
+            return False
+        finally:
+            model.journal = previous_journal
+            set_current_context(previous_context)
+
+        self.cycles += 1
+
+        return True
+
+    def commit(self, target):
+        '''Writes the pending iterations that start before target into the timeline.
+
+        Other loops being stopped advance this one as well, possibly past the target it is stopped at
+        later. The iterations beyond it are dropped and the loop's time goes back to the first of them.'''
+
+        model = get_model()
+
+        for start, period, iterations, events in self.pending:
+            if start >= target:
+                self.time = start
+                break
+
+            if period is None:
+                for time, setting, option in events:
+                    model.temporal_dict.add_entry(setting, option, time)
+
+                continue
+
+            kept = min(iterations_before(start, period, target), iterations)
+
+            model.add_periodic(start, period, kept, events)
+
+            if kept < iterations:
+                self.time = start + kept * period
+                break
+
+        self.pending = []
+
     def replace(self, loopable, num=None, target=None, args=tuple(), kwargs=dict()):
         true_target = target or time()
 
@@ -85,32 +284,18 @@ class Loopable():
         if self not in waiting_funcs:
             return
         else:
-            waiting_funcs.remove(self)
+            del waiting_funcs[self]
 
         target_end_time = target or time()
 
-        #swap out the context
-        previous_context = get_current_context()
-        set_current_context(self)
-
-        cycles = 0
-        try:
-            while time() < target_end_time:
-
-                if self.num is not None and cycles >= self.num:
-                    break
+        #every loop runs up to the target together, so iterations interleave in time order
+        scheduler.advance(target_end_time)
+        scheduler.unschedule(self)
 
-                self.func(*self.args, **self.kwargs)
-
-                cycles += 1
-
-        except EndLoopException:
-            pass
-        finally:
-            true_end_time = time()
-            set_current_context(previous_context)
+        #events are written when the loop is stopped, like when loops ran on their own
+        self.commit(target_end_time)
 
-        overtime = true_end_time - target_end_time
+        overtime = self.time - target_end_time
 
         if should_wait:
             wait(overtime)
@@ -125,7 +310,21 @@ class Model:
         self.temporal_dict = TemporalDict(args)
         self.aliases = {} # mapping from (setting, option) -> set((setting, option),...)
 
+        #(time, setting, option) of a background iteration's events, which wait for the loop to be stopped
+        self.journal = None
+
     def add_option(self, setting, option, recursively_handled=None):
+        current_time = time()
+
+        for aliased_setting, aliased_option in self.aliased_options(setting, option, recursively_handled=recursively_handled):
+            if self.journal is not None:
+                self.journal.append((current_time, aliased_setting, aliased_option))
+            else:
+                self.temporal_dict.add_entry(aliased_setting, aliased_option, current_time)
+
+    def aliased_options(self, setting, option, recursively_handled=None):
+        '''The option pair followed by every pair it is aliased to, directly or through other aliases'''
+
         recursively_handled = recursively_handled or set()
 
         option_pair = (setting, option)
@@ -135,10 +334,23 @@ class Model:
         else:
             recursively_handled.add(option_pair)
 
-        self.temporal_dict.add_entry(setting, option, time())
+        yield option_pair
 
         for aliased_setting, aliased_option in self.aliases.get(option_pair, []):
-            self.add_option(aliased_setting, aliased_option, recursively_handled=recursively_handled)
+            yield from self.aliased_options(aliased_setting, aliased_option, recursively_handled=recursively_handled)
+
+    def add_periodic(self, start, period, count, events):
+        '''Adds count iterations of a loop emitting the (offset, setting, option) events every period ms'''
+
+        pattern = []
+
+        for offset, setting, option in events:
+            if len(pattern) == 0 or pattern[-1][0] != offset:
+                pattern.append((offset, {}))
+
+            pattern[-1][1].update(self.aliased_options(setting, option))
+
+        self.temporal_dict.add_periodic(start, period, count, pattern)
 
     def add_alias(self, trigger_setting, trigger_option, aliased_setting, aliased_option):
         trigger_option_pair = (trigger_setting, trigger_option)
@@ -152,9 +364,14 @@ class Model:
 _model = None
 
 def init_api(args):
-    global _model
+    global _model, current_context, scheduler
     _model = Model(args)
 
+    #a previous run that failed part way may have left loops behind
+    current_context = None
+    waiting_funcs.clear()
+    scheduler = Scheduler()
+
 def get_model():
     global _model
     return _model
@@ -1,21 +1,20 @@
 #!/usr/bin/env python
 
-from math import ceil
-import numpy as np
-from contextlib import contextmanager
-
-import cv2
+from itertools import tee
 
 from ImageSource import ImageSource
 from ScriptParser import ScriptParser
+from Sinks import VideoSink, FrameSequenceSink, TextureSink
+from Profiler import get_profiler
 
 class Animator:
 
-    def __init__(self, args):
+    def __init__(self, args, image_source=None):
         self.args = args
         self.script_parser = ScriptParser(args)
-        self.image_source = ImageSource(args)
-        self.codec = cv2.VideoWriter_fourcc(*args.codec)
+
+        #animators can share one image source, and with it the psd, render pool and caches
+        self.image_source = image_source if image_source is not None else ImageSource(args)
 
     def parse_script(self):
 
@@ -26,120 +25,145 @@ class Animator:
         
         self.temporal_dict = temporal_dict
 
+        start, stop = self.frame_window
+
+        if start >= stop:
+            raise ValueError(f"The --start/--end window contains no frames, the timeline has {temporal_dict.frame_count}")
+
         if self.args.print_states:
             temporal_dict.print()
 
         return self
 
-    def animate(self):
+    def animate(self, create_frames=True):
+        profiler = get_profiler()
 
-        if self.args.store_new:
+        if create_frames and self.args.store_new and not self.args.stream:
             if self.args.verbose:
                 print("Finding/Generating frames")
 
-            self.image_source.create_frames(self.temporal_dict.states)
+            with profiler.stage("create_frames"):
+                self.image_source.create_frames(self.states())
 
-        if self.args.create_texture:
-            self.create_texture()
-        else:
-            self.create_video()
+        with profiler.stage("write_outputs"):
+            self.write_outputs()
 
-        return self
+        frame_cache = self.image_source.frame_cache
+        profiler.record_cache("frame_cache", frame_cache.hits, frame_cache.misses)
+
+        #the image cache is only opened when a frame was looked up in it
+        if "cache" in vars(self.image_source):
+            image_cache = self.image_source.cache
+            profiler.record_cache("image_cache", image_cache.hits, image_cache.misses)
 
-    def create_texture(self):
         if self.args.verbose:
-            print("Collecting frames")
+            print(f"Frame cache: {frame_cache.stats}")
 
-        image_list = list(self.frames)
+        return self
 
-        if self.args.verbose:
-            print(f"Creating texture from {len(image_list)} frames")
+    @property
+    def frame_window(self):
+        '''(start, stop) frame indices to render, the whole timeline unless --start or --end narrow it'''
 
-        texture = self.stitch_images(image_list)
+        frame_count = self.temporal_dict.frame_count
 
-        self.save_texture(texture)
+        start = 0 if self.args.start is None else max(self.to_frame(self.args.start), 0)
+        stop = frame_count if self.args.end is None else min(self.to_frame(self.args.end), frame_count)
 
-    def save_texture(self, texture):
-        #Defaults to saving texture in full resolution
-        if self.args.texture_dimensions is None:
+        return start, stop
 
-            if self.args.verbose:
-                print("Saving full resolution texture")
+    def to_frame(self, position):
+        value, unit = position
 
-            cv2.imwrite(str(self.args.output_path), texture)
-            return
+        if unit == "frames":
+            return value
 
-        #Otherwise we pull out path information to give each produced texture a proper filename
-        original_path = self.args.output_path
-        stem = str(original_path.stem)
-        suffix = str(original_path.suffix)
+        return self.temporal_dict.frame_at(value)
 
-        for width, height in self.args.texture_dimensions:
+    def states(self):
+        '''States of the frames in the window, the window start is looked up without going through earlier frames'''
 
-            if self.args.verbose:
-                print(f"Saving {width}x{height} texture")
+        return self.temporal_dict.states_generator(*self.frame_window)
 
-            new_path = str(original_path.with_name(f"{stem}_{width}x{height}{suffix}"))
+    def create_sink(self, kind, path):
+        if kind == "video":
+            return VideoSink(self.args, path)
 
-            resized = cv2.resize(texture, (width, height), interpolation = cv2.INTER_AREA)#TODO: make interpolation a CL argument
+        if kind == "frames":
+            return FrameSequenceSink(self.args, path)
 
-            cv2.imwrite(new_path, resized)
+        start, stop = self.frame_window
 
-    def create_video(self):
+        #only deduplicated textures need the states up front, they are read in a pass of their own
+        states = self.states() if self.args.texture_dedupe else None
+        region = self.get_trim_region() if self.args.texture_trim else None
 
-        if self.args.verbose:
-            print("Writing frames to video")
+        return TextureSink(self.args, path, stop - start, states, region)
 
-        with self.video_writer as video:
-            for frame in self.frames:
-                video.write(frame)
+    def write_outputs(self):
+        '''Feeds one pass over the frames to every output, each sink consuming the frames as they are produced'''
 
-    @property
-    @contextmanager
-    def video_writer(self):
-        frame = next(self.frames)
-        height, width, layers = frame.shape
+        sinks = [self.create_sink(kind, path) for kind, path in self.args.outputs]
 
-        writer = cv2.VideoWriter(str(self.args.output_path), self.codec, self.args.fps, (width, height))
+        #when every output only keeps distinct states, like deduplicated textures, repeated frames need not be fetched at all
+        if all(sink.distinct_only for sink in sinks):
+            states = list(sinks[0].tiles)
+        else:
+            states = self.states()
+
+        #states stream to the frame source and the sinks alike, tee only holds the frames the source looks ahead
+        states, frame_states = tee(states)
 
+        #frames lead the zip so the frame generator runs to completion and cleans up before the loop ends
         try:
-            yield writer
-        finally:
-            cv2.destroyAllWindows()
-            writer.release()
+            for frame, state in zip(self.get_frames(frame_states), states):
+                for sink in sinks:
+                    sink.add(state, frame)
+        except BaseException:
+            for sink in sinks:
+                sink.abort()
 
-    @property
-    def frames(self):
-        for state in self.temporal_dict.states:
-            yield self.image_source.get_image(state)
+            raise
+
+        for sink in sinks:
+            sink.close()
+
+    def get_trim_region(self):
+        '''(left, top, right, bottom) in frame coordinates covering every layer of the groups that change over the timeline'''
+
+        used_options = {}
 
-    def stitch_images(self, images):
-        image_matrix = self.get_image_matrix(images)
-        return cv2.vconcat([cv2.hconcat(rows) for rows in image_matrix])
+        for state in self.states():
+            for setting, option in state:
+                used_options.setdefault(setting, set()).add(option)
 
-    def get_image_matrix(self, images):
-        n = len(images)
-        layout = self.args.texture_layout
+        changing_options = [(setting, option) for setting, options in used_options.items() if len(options) > 1 for option in options]
 
-        if layout == "square":
-            width = ceil(n ** 0.5)
-            height = ceil(n / width)
-        elif layout == "horizontal":
-            width = n
-            height = 1
-        elif layout == "vertical":
-            width = 1
-            height = n
+        region = self.image_source.get_region(changing_options)
 
-        if n != width * height:
-            images = self.pad_with_blank(images, width, height)
+        if region is None:
+            #nothing changes, keep whole frames
+            height, width, _ = self.image_source.frame_shape
+            region = (0, 0, width, height)
 
-        return [images[i:i+width] for i in range(0, n, width)]
+        if self.args.verbose:
+            print(f"Trimming texture tiles to {region}")
+
+        return region
+
+    @property
+    def frames(self):
+        return self.get_frames(self.states())
+
+    def get_frames(self, states):
+        if self.args.stream:
+            yield from self.image_source.stream_frames(states)
+            return
 
-    def pad_with_blank(self, images, width, height):
-        image_height, image_width, _ = images[0].shape
-        blank_image = np.zeros((image_height,image_width,3), np.uint8)
+        profiler = get_profiler()
 
-        padding = [blank_image] * ((width * height) - len(images))
+        for state in states:
+            with profiler.frame("get_image"):
+                frame = self.image_source.get_image(state)
 
-        return images + padding
+            yield frame
@@ -4,27 +4,53 @@ from pathlib import Path
 import sys
 
 from Animator import Animator
+from Batch import Batch
+from Profiler import init_profiler, get_profiler
+from Watcher import Watcher
 from args import parseArgs
 
 from argparse import ArgumentTypeError
 
 def main(args):
 
+    init_profiler(args)
+    profiler = get_profiler()
+
     handle_directories(args)
 
-    animator = Animator(args)
-    animator.parse_script()
+    if args.batch_path is not None:
+        with profiler.stage("setup"):
+            batch = Batch(args, getArgs)
+
+        batch.run()
+        profiler.report(args.profile)
+
+        if args.verbose:
+            print("Finished")
+
+        return
+
+    with profiler.stage("setup"):
+        animator = Animator(args)
+
+    watcher = Watcher(args, animator) if args.watch else None
+
+    with profiler.stage("parse_script"):
+        animator.parse_script()
 
     if not args.no_output:
-        animator.animate()
+        with profiler.stage("animate"):
+            animator.animate()
+
+    if watcher is not None:
+        watcher.run()
+
+    profiler.report(args.profile)
 
     if args.verbose:
         print("Finished")
 
 def handle_directories(args):
-    #ensure output directory exists
-    args.output_path.parent.mkdir(parents=True, exist_ok=True)
-
     #ensure image cache directory exists
     args.directory.mkdir(parents=True, exist_ok=True)
 
@@ -37,7 +63,30 @@ def handle_directories(args):
             if item.is_file():
                 item.unlink(missing_ok=True)
 
-def getArgs():
+def position(value):
+    '''A point on the timeline, in ms of script time (1500 or 1500ms) or as a frame index (36f)'''
+
+    text = value.strip().lower()
+
+    try:
+        if text.endswith("f"):
+            return int(text[:-1]), "frames"
+
+        return float(text.removesuffix("ms")), "ms"
+    except ValueError:
+        raise ArgumentTypeError(f"invalid timeline position {value!r}, use ms (1500, 1500ms) or frames (36f)") from None
+
+def output_target(value):
+    '''kind:path of an output, e.g. video:out.avi, texture:out.png or frames:out_frames/'''
+
+    kind, separator, path = value.partition(":")
+
+    if separator == "" or kind not in ("video", "texture", "frames") or path == "":
+        raise ArgumentTypeError(f"invalid output {value!r}, use video:path, texture:path or frames:directory")
+
+    return kind, Path(path)
+
+def getArgs(argv=None):
     parserSetup = {
         "description": "Create animations programatically from a psd file.",
         "args": [
@@ -45,12 +94,40 @@ def getArgs():
                 "flags": ["-s", "--script-path"],
                 "options": {
                     "type": Path,
-                    "required": True,
+                    "default": None,
                     "metavar": "Path",
                     "dest": "script_path",
                     "help": "Path to animation script file"
                 }
             },
+            {
+                "flags": ["--timeline"],
+                "options": {
+                    "type": Path,
+                    "default": None,
+                    "metavar": "Path",
+                    "dest": "timeline_path",
+                    "help": "Render a compiled timeline .json instead of running a script, compiled timelines are kept in the image cache under timelines/"
+                }
+            },
+            {
+                "flags": ["--batch"],
+                "options": {
+                    "type": Path,
+                    "default": None,
+                    "metavar": "Path",
+                    "dest": "batch_path",
+                    "help": "Render every job of a JSON job manifest against the psd in one process, rendering states shared between jobs once"
+                }
+            },
+            {
+                "flags": ["--no-timeline-cache"],
+                "options": {
+                    "dest": "timeline_cache",
+                    "action": "store_false",
+                    "help": "Always execute the script instead of reusing its compiled timeline"
+                }
+            },
             {
                 "flags": ["-o", "--output-path"],
                 "options": {
@@ -61,6 +138,17 @@ def getArgs():
                     "help": "Animation output path (default: output.avi for video, output.png for textures)"
                 }
             },
+            {
+                "flags": ["--output"],
+                "options": {
+                    "dest": "outputs",
+                    "type": output_target,
+                    "action": "append",
+                    "default": None,
+                    "metavar": "kind:Path",
+                    "help": "Repeatable output target fed from a single pass over the frames: video:out.avi, texture:out.png or frames:directory. Replaces -o and -t"
+                }
+            },
             {
                 "flags": ["-p", "--psd-path"],
                 "options": {
@@ -81,6 +169,25 @@ def getArgs():
                     "help": "Path to the image cache (defaults to ./image_cache)"
                 }
             },
+            {
+                "flags": ["--cache-format"],
+                "options": {
+                    "dest": "cache_format",
+                    "default": "png",
+                    "choices": ("png", "pack"),
+                    "help": "How new frames are stored in the image cache: a png per frame, or one memory mapped frame pack per psd that is read without decoding (default: png)"
+                }
+            },
+            {
+                "flags": ["--cache-write-queue"],
+                "options": {
+                    "dest": "cache_write_queue",
+                    "type": int,
+                    "default": 16,
+                    "metavar": "int",
+                    "help": "Most rendered frames waiting to be written to the image cache before rendering waits for the disk (default: 16)"
+                }
+            },
             {
                 "flags": ["--clear-cache"],
                 "options": {
@@ -119,6 +226,56 @@ def getArgs():
                     "help": "Sets the codec used when generating output video (default: mp4v)"
                 }
             },
+            {
+                "flags": ["--start"],
+                "options": {
+                    "dest": "start",
+                    "type": position,
+                    "default": None,
+                    "metavar": "ms|frames",
+                    "help": "Only render from this point of the timeline, in ms (1500) or frames (36f)"
+                }
+            },
+            {
+                "flags": ["--end"],
+                "options": {
+                    "dest": "end",
+                    "type": position,
+                    "default": None,
+                    "metavar": "ms|frames",
+                    "help": "Only render up to, not including, this point of the timeline, in ms (3000) or frames (72f)"
+                }
+            },
+            {
+                "flags": ["--preview-scale"],
+                "options": {
+                    "dest": "preview_scale",
+                    "type": float,
+                    "default": None,
+                    "metavar": "float",
+                    "help": "Render a low resolution preview at 1/n scale, e.g. 0.5 or 0.25. Previews are cached separately from full resolution frames"
+                }
+            },
+            {
+                "flags": ["--frame-cache-mb"],
+                "options": {
+                    "dest": "frame_cache_mb",
+                    "type": int,
+                    "default": 512,
+                    "metavar": "int",
+                    "help": "Memory budget in megabytes for decoded frames kept between uses (default: 512)"
+                }
+            },
+            {
+                "flags": ["--snapshot-mb"],
+                "options": {
+                    "dest": "snapshot_mb",
+                    "type": int,
+                    "default": 256,
+                    "metavar": "int",
+                    "help": "Memory budget in megabytes per render process for the partial composites kept below the most often changing groups (default: 256)"
+                }
+            },
             {
                 "flags": ["--dont-store"],
                 "options": {
@@ -127,6 +284,14 @@ def getArgs():
                     "help": "If set newly generated images will not be stored to the image directory"
                 }
             },
+            {
+                "flags": ["--stream"],
+                "options": {
+                    "dest": "stream",
+                    "action": "store_true",
+                    "help": "Render frames straight into the output in timeline order instead of filling the image cache first"
+                }
+            },
             {
                 "flags": ["-v", "--verbose"],
                 "options": {
@@ -143,6 +308,26 @@ def getArgs():
                     "help": "Print the full list of parsed states"
                 }
             },
+            {
+                "flags": ["--watch"],
+                "options": {
+                    "dest": "watch",
+                    "action": "store_true",
+                    "help": "Stay running after rendering and render again whenever the script or a module it imports changes"
+                }
+            },
+            {
+                "flags": ["--profile"],
+                "options": {
+                    "dest": "profile",
+                    "nargs": "?",
+                    "const": Path("./profile.json"),
+                    "default": None,
+                    "type": Path,
+                    "metavar": "Path",
+                    "help": "Time each stage of the run, print a summary and write a JSON report (default path: ./profile.json)"
+                }
+            },
             {
                 "flags": ["--no-output"],
                 "options": {
@@ -177,6 +362,30 @@ def getArgs():
                     "help": "Takes a list of one or more widthXheight pairs for the output dimensions of the texture. Defaults to full scale. Example: --texture-dimensions 1280x800,1080x720"
                 }
             },
+            {
+                "flags": ["--texture-dedupe"],
+                "options": {
+                    "dest": "texture_dedupe",
+                    "action": "store_true",
+                    "help": "Store each distinct frame once in the texture and write a .json frame index next to it mapping timeline frames to tiles"
+                }
+            },
+            {
+                "flags": ["--texture-trim"],
+                "options": {
+                    "dest": "texture_trim",
+                    "action": "store_true",
+                    "help": "Only store the region covered by changing groups in each tile, the rest is saved once as a _base image and the region is recorded in a .json sidecar"
+                }
+            },
+            {
+                "flags": ["--texture-memmap"],
+                "options": {
+                    "dest": "texture_memmap",
+                    "action": "store_true",
+                    "help": "Assemble textures in memory mapped temporary files next to the output instead of in RAM"
+                }
+            },
             {
                 "flags": ["--force-vector"],
                 "options": {
@@ -188,7 +397,7 @@ def getArgs():
         ]
     }
 
-    args = parseArgs(parserSetup)
+    args = parseArgs(parserSetup, argv)
 
     #Texture dimension validation and extraction
     if args.texture_dimensions is not None:
@@ -201,6 +410,28 @@ def getArgs():
         except Exception:
             ArgumentTypeError("Invalid texture dimensions")
 
+    #A timeline comes either from a script or from a compiled timeline file, batches name them per job
+    if args.script_path is None and args.timeline_path is None and args.batch_path is None:
+        raise ArgumentTypeError("either a script-path, a timeline or a batch is required")
+
+    #Cache writer validation
+    if args.cache_write_queue < 1:
+        raise ArgumentTypeError("cache-write-queue must be at least 1")
+
+    #Frame cache and snapshot validation
+    if args.frame_cache_mb < 0:
+        raise ArgumentTypeError("frame-cache-mb must not be negative")
+
+    if args.snapshot_mb < 0:
+        raise ArgumentTypeError("snapshot-mb must not be negative")
+
+    #Preview scale validation, previews are composited on a grid a whole number of times coarser than the psd
+    if args.preview_scale is not None:
+        if not 0 < args.preview_scale <= 1 or abs(1 / args.preview_scale - round(1 / args.preview_scale)) > 0.01:
+            raise ArgumentTypeError("preview-scale must be 1/n for a whole number n, e.g. 0.5, 0.25 or 0.2")
+
+        args.preview_scale = 1 / round(1 / args.preview_scale)
+
     #Speed multiplier validation
     if args.speed_multiplier <= 0:
         raise ArgumentTypeError("speed-multiplier must be a positive value")
@@ -209,6 +440,10 @@ def getArgs():
     if args.output_path is None:
         args.output_path = Path("./output/out.png") if args.create_texture else Path("./output/out.avi")
 
+    #Without explicit --output targets, -o and -t describe the single output
+    if args.outputs is None:
+        args.outputs = [("texture" if args.create_texture else "video", args.output_path)]
+
     return args
 
 if __name__ == '__main__':
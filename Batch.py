@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+from itertools import chain
+import json
+
+from Animator import Animator
+from ImageSource import ImageSource
+from Profiler import get_profiler
+
+class Batch:
+    '''Renders every job of a job manifest against one psd in a single process.
+
+    The manifest is a JSON file {"jobs": [...]}, each job mapping AutoAnim's long flag names without
+    dashes to values, e.g. {"script-path": "walk.py", "output-path": "walk.avi", "fps": 30}. Flags set
+    to true are switches, relative paths are relative to the manifest. Options shared by all jobs
+    (psd, image cache, preview scale, streaming...) come from the command line.
+
+    Every script is parsed against a fresh API model, then the union of their states is rendered
+    once and every job writes its output from the shared image source and frame cache.'''
+
+    #args every job takes from the batch command line rather than from its manifest entry
+    shared_options = (
+        "psd_path", "directory", "clear_cache", "frame_cache_mb", "snapshot_mb", "store_new", "stream", "preview_scale",
+        "verbose", "profile", "force_vector", "timeline_cache", "no_output", "watch", "batch_path",
+    )
+
+    path_options = ("script-path", "output-path", "timeline")
+
+    def __init__(self, args, get_args):
+        self.args = args
+        self.get_args = get_args
+        self.image_source = ImageSource(args)
+
+        #the render pool stays up from one job to the next
+        self.image_source.resident = True
+
+    def load_jobs(self):
+        manifest_path = self.args.batch_path
+
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+
+        jobs = manifest.get("jobs") if isinstance(manifest, dict) else None
+
+        if not isinstance(jobs, list) or len(jobs) == 0:
+            raise ValueError(f"Job manifest {manifest_path} must contain a non empty 'jobs' list")
+
+        return [self.job_args(job, manifest_path.parent) for job in jobs]
+
+    def job_args(self, job, base_directory):
+        argv = []
+
+        for flag, values in job.items():
+            #lists repeat a flag, like several outputs
+            for value in values if isinstance(values, list) else [values]:
+                if value is False or value is None:
+                    continue
+
+                argv.append(f"--{flag}")
+
+                if value is True:
+                    continue
+
+                if flag in self.path_options:
+                    value = base_directory / value
+                elif flag == "output":
+                    kind, _, path = value.partition(":")
+                    value = f"{kind}:{base_directory / path}"
+
+                argv.append(str(value))
+
+        args = self.get_args(argv)
+
+        for option in self.shared_options:
+            setattr(args, option, getattr(self.args, option))
+
+        return args
+
+    def run(self):
+        profiler = get_profiler()
+        animators = []
+
+        for args in self.load_jobs():
+            if self.args.verbose:
+                print(f"Parsing {args.script_path or args.timeline_path}")
+
+            with profiler.stage("parse_script"):
+                animators.append(Animator(args, self.image_source).parse_script())
+
+        if self.args.no_output:
+            return
+
+        try:
+            #render the union of every job's states once, each job then only reads them back
+            if self.args.store_new and not self.args.stream:
+                if self.args.verbose:
+                    print(f"Finding/Generating frames for {len(animators)} jobs")
+
+                with profiler.stage("create_frames"):
+                    self.image_source.create_frames(chain.from_iterable(animator.states() for animator in animators))
+
+            for animator in animators:
+                if self.args.verbose:
+                    print(f"Writing {', '.join(str(path) for _, path in animator.args.outputs)}")
+
+                with profiler.stage("animate"):
+                    animator.animate(create_frames=False)
+
+        finally:
+            self.image_source.close()
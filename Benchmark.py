@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from contextlib import contextmanager
+import json
+import platform
+
+import numpy as np
+import cv2
+
+from psd_tools.constants import BlendMode, ChannelID, Compression, SectionDivider, Tag
+from psd_tools.psd import PSD
+from psd_tools.psd.header import FileHeader
+from psd_tools.psd.image_data import ImageData
+from psd_tools.psd.image_resources import ImageResources
+from psd_tools.psd.layer_and_mask import (
+    ChannelData, ChannelDataList, ChannelImageData, ChannelInfo,
+    LayerAndMaskInformation, LayerFlags, LayerInfo, LayerRecord, LayerRecords
+)
+from psd_tools.psd.tagged_blocks import TaggedBlocks
+
+from AutoAnim import getArgs
+from ImageSource import ImageSource
+from ScriptParser import ScriptParser
+from TextureAtlas import TextureAtlas
+from args import parseArgs
+
+#psd channel order is alpha first, then red, green, blue
+CHANNELS = ((ChannelID.TRANSPARENCY_MASK, 3), (ChannelID.CHANNEL_0, 0), (ChannelID.CHANNEL_1, 1), (ChannelID.CHANNEL_2, 2))
+
+def layer_record(name, bbox=(0, 0, 0, 0), pixels=None, visible=True, opacity=255, divider=None):
+    '''Low level psd layer record and its channel data. Records without pixels are group markers'''
+
+    tagged_blocks = TaggedBlocks()
+
+    if divider is not None:
+        tagged_blocks.set_data(Tag.SECTION_DIVIDER_SETTING, divider)
+
+    left, top, right, bottom = bbox
+
+    record = LayerRecord(
+        top=top, left=left, bottom=bottom, right=right, name=name, opacity=opacity,
+        blend_mode=BlendMode.NORMAL, flags=LayerFlags(visible=visible), tagged_blocks=tagged_blocks
+    )
+
+    channels = []
+
+    for channel_id, index in CHANNELS:
+        record.channel_info.append(ChannelInfo(id=channel_id, length=0))
+        channel = ChannelData(compression=Compression.RAW)
+
+        if pixels is not None:
+            channel.set_data(np.ascontiguousarray(pixels[:, :, index]).tobytes(), right - left, bottom - top, 8)
+
+        channels.append(channel)
+
+    return record, ChannelDataList(channels)
+
+def build_psd(path, width, height, groups, options, seed=0):
+    '''Writes a synthetic scene: a background, `groups` controllable groups of `options` translucent
+    rectangles each, and an ignored group with one static layer on top'''
+
+    rng = np.random.default_rng(seed)
+    records = []
+
+    def rectangle(name, bbox, visible=True):
+        left, top, right, bottom = bbox
+
+        #flat colour with a soft alpha ramp, compresses roughly like painted artwork rather than noise
+        ramp = np.linspace(64, 255, right - left, dtype=np.float32)
+
+        pixels = np.empty((bottom - top, right - left, 4), np.uint8)
+        pixels[..., :3] = rng.integers(0, 256, 3)
+        pixels[..., 3] = ramp[np.newaxis, :]
+
+        records.append(layer_record(name, bbox, pixels, visible=visible, opacity=int(rng.integers(128, 256))))
+
+    rectangle("background", (0, 0, width, height))
+
+    #records are listed bottom to top, a group is its closing divider, its children, then the group itself
+    for group in range(groups):
+        records.append(layer_record("</Layer group>", divider=SectionDivider.BOUNDING_SECTION_DIVIDER))
+
+        for option in range(options):
+            left, top = int(rng.integers(0, width * 3 // 4)), int(rng.integers(0, height * 3 // 4))
+            rectangle(str(option), (left, top, left + width // 4, top + height // 4), visible=option == 0)
+
+        records.append(layer_record(f"group{group}", divider=SectionDivider.OPEN_FOLDER))
+
+    records.append(layer_record("</Layer group>", divider=SectionDivider.BOUNDING_SECTION_DIVIDER))
+    rectangle("overlay", (0, 0, width // 2, height // 2))
+    records.append(layer_record("__static", divider=SectionDivider.OPEN_FOLDER))
+
+    layer_info = LayerInfo(
+        layer_count=len(records),
+        layer_records=LayerRecords([record for record, _ in records]),
+        channel_image_data=ChannelImageData([channels for _, channels in records])
+    )
+
+    header = FileHeader(width=width, height=height, depth=8, channels=3, color_mode=3)
+
+    psd = PSD(
+        header=header,
+        image_data=ImageData.new(header),
+        image_resources=ImageResources.new(),
+        layer_and_mask_information=LayerAndMaskInformation(layer_info=layer_info)
+    )
+
+    with open(path, "wb") as file:
+        psd.write(file)
+
+def build_script(path, groups, options, duration):
+    '''Writes an animation script pulsing every group in the background at a different rate for `duration` ms'''
+
+    settings = ",\n".join(f'        "group{group}": {[str(option) for option in range(options)]!r}' for group in range(groups))
+    sequences = "\n".join(f'    at.sequence("group{group}").pulse("group{group}", {40 * (group + 1)}).loop_background()' for group in range(groups))
+
+    path.write_text(
+        "\n"
+        "def main():\n"
+        "    settings = {\n"
+        f"{settings}\n"
+        "    }\n"
+        "\n"
+        "    at = AnimTools(settings).init_with_first()\n"
+        "\n"
+        f"{sequences}\n"
+        "\n"
+        f"    wait({duration})\n"
+    )
+
+class StageTimer:
+    '''Collects wall clock time per benchmark stage'''
+
+    def __init__(self):
+        self.results = []
+
+    @contextmanager
+    def stage(self, name, items=1):
+        print(f"{name}...", end=" ", flush=True)
+
+        start = perf_counter()
+        yield
+        seconds = perf_counter() - start
+
+        self.results.append({"stage": name, "seconds": seconds, "items": items, "ms_per_item": seconds * 1000 / max(items, 1)})
+
+        print(f"{seconds:.3f}s ({items} items)")
+
+def run(bench_args, work_dir):
+    psd_path = work_dir / "scene.psd"
+    script_path = work_dir / "benchmark_scene.py"
+
+    build_psd(psd_path, bench_args.width, bench_args.height, bench_args.groups, bench_args.options, bench_args.seed)
+    build_script(script_path, bench_args.groups, bench_args.options, bench_args.duration)
+
+    args = getArgs([
+        "-s", str(script_path),
+        "-p", str(psd_path),
+        "-i", str(work_dir / "image_cache"),
+        "-o", str(work_dir / "out.avi"),
+        "--fps", str(bench_args.fps),
+        "--cache-format", bench_args.cache_format,
+    ])
+    args.directory.mkdir(parents=True, exist_ok=True)
+
+    timer = StageTimer()
+
+    with timer.stage("parse_script"):
+        temporal_dict = ScriptParser(args).parse_script()
+
+    with timer.stage("states_generator", temporal_dict.frame_count):
+        states = list(temporal_dict.states_generator())
+
+    unique_states = list(dict.fromkeys(states))
+
+    with timer.stage("open_psd"):
+        image_source = ImageSource(args)
+        image_source.psd_groups
+
+    renders = {}
+
+    with timer.stage("generate_image", len(unique_states)):
+        for state in unique_states:
+            renders[state] = image_source.compositor.compose_array(state)
+
+    with timer.stage("cache_save", len(unique_states)):
+        for state, pixels in renders.items():
+            image_source.cache.add(state)
+            image_source.cache.write(state, pixels)
+
+        image_source.cache.save_manifest()
+
+    #pack reads are views into a memory map, copying them makes the pixels actually get read like png decoding does
+    with timer.stage("cache_load", len(unique_states)):
+        frames = {state: np.array(image_source.load_image(state)) for state in unique_states}
+
+    with timer.stage("video_encoding", len(states)):
+        height, width, _ = frames[states[0]].shape
+        writer = cv2.VideoWriter(str(args.output_path), cv2.VideoWriter_fourcc(*args.codec), args.fps, (width, height))
+
+        for state in states:
+            writer.write(frames[state])
+
+        writer.release()
+
+    texture_states = states[:bench_args.texture_frames]
+    args.output_path = work_dir / "out.png"
+
+    with timer.stage("texture_stitching", len(texture_states)):
+        atlas = TextureAtlas(args, len(texture_states))
+
+        for index, state in enumerate(texture_states):
+            atlas.add(index, frames[state])
+
+        atlas.save()
+
+    return {
+        "config": {key: value for key, value in vars(bench_args).items() if key != "output_path"},
+        "platform": {"python": platform.python_version(), "machine": platform.machine(), "numpy": np.__version__, "opencv": cv2.__version__},
+        "frames": len(states),
+        "unique_states": len(unique_states),
+        "stages": timer.results,
+    }
+
+def main(bench_args):
+    with TemporaryDirectory() as work_dir:
+        results = run(bench_args, Path(work_dir))
+
+    with open(bench_args.output_path, "w") as file:
+        json.dump(results, file, indent=4)
+
+    print(f"Wrote results for {results['frames']} frames ({results['unique_states']} unique) to {bench_args.output_path}")
+
+def getBenchmarkArgs():
+    parserSetup = {
+        "description": "Time each stage of the AutoAnim pipeline on a synthetic layered scene.",
+        "args": [
+            {
+                "flags": ["-o", "--output-path"],
+                "options": {
+                    "default": Path("./benchmark.json"),
+                    "type": Path,
+                    "metavar": "Path",
+                    "dest": "output_path",
+                    "help": "Where to write the JSON results (default: ./benchmark.json)"
+                }
+            },
+            {
+                "flags": ["--width"],
+                "options": {
+                    "dest": "width",
+                    "type": int,
+                    "default": 1280,
+                    "metavar": "int",
+                    "help": "Canvas width in pixels (default: 1280)"
+                }
+            },
+            {
+                "flags": ["--height"],
+                "options": {
+                    "dest": "height",
+                    "type": int,
+                    "default": 720,
+                    "metavar": "int",
+                    "help": "Canvas height in pixels (default: 720)"
+                }
+            },
+            {
+                "flags": ["--groups"],
+                "options": {
+                    "dest": "groups",
+                    "type": int,
+                    "default": 4,
+                    "metavar": "int",
+                    "help": "Number of controllable groups (default: 4)"
+                }
+            },
+            {
+                "flags": ["--options"],
+                "options": {
+                    "dest": "options",
+                    "type": int,
+                    "default": 5,
+                    "metavar": "int",
+                    "help": "Number of options per group (default: 5)"
+                }
+            },
+            {
+                "flags": ["--duration"],
+                "options": {
+                    "dest": "duration",
+                    "type": int,
+                    "default": 10000,
+                    "metavar": "ms",
+                    "help": "Timeline length in milliseconds (default: 10000)"
+                }
+            },
+            {
+                "flags": ["--fps"],
+                "options": {
+                    "dest": "fps",
+                    "type": int,
+                    "default": 24,
+                    "metavar": "int",
+                    "help": "Frames per second of the timeline (default: 24)"
+                }
+            },
+            {
+                "flags": ["--texture-frames"],
+                "options": {
+                    "dest": "texture_frames",
+                    "type": int,
+                    "default": 64,
+                    "metavar": "int",
+                    "help": "Number of frames stitched in the texture stage (default: 64)"
+                }
+            },
+            {
+                "flags": ["--cache-format"],
+                "options": {
+                    "dest": "cache_format",
+                    "default": "png",
+                    "choices": ("png", "pack"),
+                    "help": "Image cache backend timed by the cache stages (default: png)"
+                }
+            },
+            {
+                "flags": ["--seed"],
+                "options": {
+                    "dest": "seed",
+                    "type": int,
+                    "default": 0,
+                    "metavar": "int",
+                    "help": "Seed for the synthetic scene (default: 0)"
+                }
+            },
+        ]
+    }
+
+    return parseArgs(parserSetup)
+
+if __name__ == '__main__':
+    main(getBenchmarkArgs())
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+from threading import Lock, get_ident
+import os
+
+from PIL import Image
+import numpy as np
+import cv2
+
+from State import State
+from Profiler import get_profiler
+
+class PngBackend:
+    '''One png file per state, slow to encode but readable by any image tool'''
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def path(self, key):
+        return self.cache.directory / f"{key}.{State.extension}"
+
+    def allocate(self, key):
+        return {}
+
+    def write(self, key, entry, pixels):
+        path = self.path(key)
+
+        #written to the side and renamed, readers never see half a png
+        #the temp name is unique per process and writer thread, so concurrent renders of the same state never share one
+        temp_path = path.with_name(f".{path.name}.{os.getpid()}.{get_ident()}.tmp")
+
+        try:
+            with get_profiler().frame("png_save"):
+                Image.fromarray(pixels).save(temp_path, format="PNG")
+
+            os.replace(temp_path, path)
+        except BaseException:
+            #a full disk or an interrupt must not leave half a png behind
+            temp_path.unlink(missing_ok=True)
+            raise
+
+    def read(self, key, entry):
+        with get_profiler().frame("png_read"):
+            return cv2.imread(str(self.path(key)))
+
+    def delete(self, key, entry):
+        self.path(key).unlink(missing_ok=True)
+
+    def drop(self, source_key):
+        pass
+
+    def flush(self):
+        pass
+
+class PackBackend:
+    '''All frames rendered from one psd in a single memory mapped file of fixed size BGR slots.
+
+    Slots are assigned when a state is added and recorded in its manifest entry, the pack's frame
+    shape lives in the manifest as well. Runs sharing the cache directory may fill one pack at the
+    same time, so the pack's file size is what counts as allocated: a slot is taken by growing the
+    file by one slot under the cache's lock. Slots of removed entries are only reclaimed when the
+    whole pack is dropped. Reads are zero copy read only views into the map, which is remapped when
+    a slot lies beyond it. Views into an older mapping stay valid.'''
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.arrays = {}
+
+        #remapping replaces a pack's array, so writer threads must not map it halfway through
+        self.lock = Lock()
+
+    @property
+    def packs(self):
+        return self.cache.packs
+
+    def path(self, source_key):
+        return self.cache.directory / f"{source_key}.pack"
+
+    def frame_size(self, pack):
+        return int(np.prod(pack["shape"]))
+
+    def array(self, source_key, slot):
+        '''Map of the pack covering slot'''
+
+        with self.lock:
+            array = self.arrays.get(source_key)
+
+            if array is None or slot >= len(array):
+                pack = self.packs[source_key]
+                slots = self.path(source_key).stat().st_size // self.frame_size(pack)
+
+                if slot >= slots:
+                    raise ValueError(f"Slot {slot} lies beyond the end of the pack")
+
+                array = self.arrays[source_key] = np.memmap(self.path(source_key), dtype=np.uint8, mode="r+", shape=(slots, *pack["shape"]))
+
+            return array
+
+    def allocate(self, key):
+        source_key = self.cache.source_key
+        pack = self.packs.get(source_key)
+
+        if pack is None:
+            height, width, _ = self.cache.image_source.frame_shape
+            pack = self.packs[source_key] = {"shape": [height, width, 3]}
+
+        frame_size = self.frame_size(pack)
+        path = self.path(source_key)
+
+        #another run may have grown the file since, the slot is wherever the file ends now
+        with self.cache.locked():
+            path.touch()
+
+            slot = -(-path.stat().st_size // frame_size)
+            os.truncate(path, (slot + 1) * frame_size)
+
+        return {"slot": slot}
+
+    def write(self, key, entry, pixels):
+        with get_profiler().frame("pack_write"):
+            #RGBA to BGR is a reversed channel slice, copied straight into the slot
+            np.copyto(self.array(entry["source"], entry["slot"])[entry["slot"]], pixels[..., 2::-1])
+
+    def read(self, key, entry):
+        source_key = entry["source"]
+
+        if "slot" not in entry or source_key not in self.packs:
+            return None
+
+        try:
+            frame = np.asarray(self.array(source_key, entry["slot"])[entry["slot"]])
+        except (FileNotFoundError, ValueError):
+            #the pack is missing or shorter than the manifest says
+            return None
+
+        frame.flags.writeable = False
+
+        return frame
+
+    def delete(self, key, entry):
+        pass
+
+    def drop(self, source_key):
+        '''Deletes the whole pack of an outdated psd'''
+
+        with self.lock:
+            self.arrays.pop(source_key, None)
+
+        self.packs.pop(source_key, None)
+        self.path(source_key).unlink(missing_ok=True)
+
+    def flush(self):
+        with self.lock:
+            arrays = list(self.arrays.values())
+
+        for array in arrays:
+            array.flush()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+from concurrent.futures import ThreadPoolExecutor as ThreadPool
+from collections import OrderedDict
+from threading import Lock
+from time import perf_counter
+
+from Profiler import get_profiler
+
+class CacheWriter:
+    '''Stores rendered frames in the image cache on background threads.
+
+    At most max_pending frames wait to be written, submitting another blocks until the oldest is
+    done, which holds the render pool back when the disk is slower than rendering. A failed write
+    removes its cache entry and is raised to the submitter, and writes that never ran when the writer
+    is aborted are removed as well, so the manifest only lists frames that were fully written.'''
+
+    def __init__(self, cache, max_pending):
+        self.cache = cache
+        self.max_pending = max_pending
+        self.thread_pool = ThreadPool()
+
+        #state -> future, oldest first
+        self.pending = OrderedDict()
+
+        self.lock = Lock()
+        self.count = 0
+        self.bytes = 0
+        self.blocked = 0.0
+        self.started = None
+        self.finished = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def submit(self, state, pixels):
+        '''Adds the state to the cache and queues its pixels, which must not change afterwards'''
+
+        if self.started is None:
+            self.started = perf_counter()
+
+        self.collect_done()
+
+        if len(self.pending) >= self.max_pending:
+            start = perf_counter()
+
+            while len(self.pending) >= self.max_pending:
+                self.collect(*self.pending.popitem(last=False))
+
+            self.blocked += perf_counter() - start
+
+        self.cache.add(state)
+        self.pending[state] = self.thread_pool.submit(self.write, state, pixels)
+
+    def write(self, state, pixels):
+        self.cache.write(state, pixels)
+
+        with self.lock:
+            self.count += 1
+            self.bytes += pixels.nbytes
+            self.finished = perf_counter()
+
+    def collect(self, state, future):
+        try:
+            future.result()
+        except Exception:
+            self.cache.discard(state)
+            raise
+
+    def collect_done(self):
+        '''Collects finished writes at the head of the queue, raising the first failure'''
+
+        while len(self.pending) != 0:
+            state, future = next(iter(self.pending.items()))
+
+            if not future.done():
+                return
+
+            del self.pending[state]
+            self.collect(state, future)
+
+    def wait(self, state):
+        '''Blocks until a queued write of the state is on disk, so it can be read back'''
+
+        future = self.pending.pop(state, None)
+
+        if future is not None:
+            self.collect(state, future)
+
+    def close(self):
+        try:
+            while len(self.pending) != 0:
+                self.collect(*self.pending.popitem(last=False))
+        finally:
+            self.thread_pool.shutdown()
+
+        self.report()
+
+    def abort(self):
+        #writes already running finish, queued ones are dropped along with their entries
+        self.thread_pool.shutdown(wait=True, cancel_futures=True)
+
+        for state, future in self.pending.items():
+            if future.cancelled() or future.exception() is not None:
+                self.cache.discard(state)
+
+        self.pending.clear()
+
+    @property
+    def stats(self):
+        elapsed = (self.finished - self.started) if self.finished is not None else 0.0
+
+        if elapsed <= 0:
+            return f"{self.count} frames written"
+
+        return (
+            f"{self.count} frames, {self.bytes / 2**20:.1f}MB in {elapsed:.2f}s "
+            f"({self.bytes / 2**20 / elapsed:.1f}MB/s, {self.count / elapsed:.1f} frames/s), "
+            f"rendering held back for {self.blocked:.2f}s"
+        )
+
+    def report(self):
+        profiler = get_profiler()
+        profiler.count("cache_writes", self.count)
+        profiler.count("cache_write_bytes", self.bytes)
+        profiler.count("cache_write_blocked_ms", round(self.blocked * 1000))
+
+        if self.cache.args.verbose and self.count != 0:
+            print(f"Cache writer: {self.stats}")
@@ -0,0 +1,385 @@
+#!/usr/bin/env python
+
+from psd_tools import compose
+from psd_tools.constants import BlendMode
+import numpy as np
+from PIL import Image
+
+from operator import itemgetter
+
+class LayerRaster:
+    '''A layer rendered once into premultiplied float RGBA, positioned by its bbox on the psd canvas'''
+
+    def __init__(self, pixels, bbox):
+        self.pixels = pixels
+        self.bbox = bbox
+
+    @classmethod
+    def from_pil(cls, pil_image, offset, factor=1):
+        pixels = np.asarray(pil_image.convert("RGBA"), dtype=np.float32) / 255
+
+        #premultiply so that alpha-over is a single multiply-add
+        pixels[..., :3] *= pixels[..., 3:]
+
+        left, top = offset
+        height, width, _ = pixels.shape
+        bbox = (left, top, left + width, top + height)
+
+        if factor != 1:
+            pixels, bbox = downsample(pixels, bbox, factor)
+
+        return cls(pixels, bbox)
+
+    @classmethod
+    def flatten(cls, rasters):
+        '''Merges a run of rasters into one, alpha-over is associative so the result blends identically'''
+
+        if len(rasters) == 0:
+            return None
+
+        if len(rasters) == 1:
+            return rasters[0]
+
+        lefts, tops, rights, bottoms = zip(*(raster.bbox for raster in rasters))
+        bbox = (min(lefts), min(tops), max(rights), max(bottoms))
+
+        pixels = np.zeros((bbox[3] - bbox[1], bbox[2] - bbox[0], 4), dtype=np.float32)
+
+        for raster in rasters:
+            alpha_over(pixels, bbox, raster)
+
+        return cls(pixels, bbox)
+
+def scale_box(box, factor):
+    '''Smallest box on the grid downsampled by factor that covers box'''
+
+    left, top, right, bottom = box
+
+    return left // factor, top // factor, -(-right // factor), -(-bottom // factor)
+
+def downsample(pixels, box, factor):
+    '''Box filters premultiplied pixels positioned at box onto the grid downsampled by factor.
+
+    Every downsampled pixel averages the same factor x factor block of the psd canvas no matter
+    which layer it comes from, so previews line up with a full render scaled down the same way.'''
+
+    left, top, right, bottom = box
+    scaled = scaled_left, scaled_top, scaled_right, scaled_bottom = scale_box(box, factor)
+
+    width, height = scaled_right - scaled_left, scaled_bottom - scaled_top
+    padded = np.zeros((height * factor, width * factor, pixels.shape[2]), dtype=np.float32)
+
+    offset_left, offset_top = left - scaled_left * factor, top - scaled_top * factor
+    padded[offset_top:offset_top + bottom - top, offset_left:offset_left + right - left] = pixels
+
+    return padded.reshape(height, factor, width, factor, -1).mean(axis=(1, 3)), scaled
+
+def alpha_over(target, target_box, raster):
+    '''Blends a premultiplied raster over the target array in place, clipped to target_box'''
+
+    target_left, target_top, target_right, target_bottom = target_box
+    left, top, right, bottom = raster.bbox
+
+    clip_left, clip_top = max(left, target_left), max(top, target_top)
+    clip_right, clip_bottom = min(right, target_right), min(bottom, target_bottom)
+
+    if clip_right <= clip_left or clip_bottom <= clip_top:
+        return
+
+    source = raster.pixels[clip_top - top:clip_bottom - top, clip_left - left:clip_right - left]
+    target = target[clip_top - target_top:clip_bottom - target_top, clip_left - target_left:clip_right - target_left]
+
+    target *= 1 - source[..., 3:]
+    target += source
+
+class Level:
+    '''A slice of the layer stack: either a run of static layers or a single controllable group'''
+
+    def __init__(self, group=None):
+        self.group = group
+        self.layers = []
+
+    def __repr__(self):
+        return f"Level(group={self.group!r}, layers={len(self.layers)})"
+
+    @property
+    def is_static(self):
+        return self.group is None
+
+class Compositor:
+    '''Composites states from layer rasters that are only decoded once per psd.
+
+    The partial composite below the groups that change most is kept from the previous state, so
+    a state that changes group k only recomposites the levels from k, or the nearest kept level
+    below it, upward, and only inside the bboxes of the layers that were swapped. Everything else
+    is reused from the previous frame.
+
+    With a factor above 1 the rasters are downsampled once when decoded and everything is
+    composited on the smaller grid.'''
+
+    def __init__(self, psd, psd_groups, default_layers, factor=1, snapshot_budget=256 * 2**20):
+        self.psd = psd
+        self.psd_groups = psd_groups
+        self.default_layers = default_layers
+        self.factor = factor
+        self.canvas_box = scale_box(psd.viewbox, factor)
+        self.layers = set(default_layers)
+
+        for group_options in psd_groups.values():
+            self.layers.update(group_options.values())
+
+        #PSD stacking order, bottom to top
+        self.stack_order = {layer: index for index, layer in enumerate(psd.descendants()) if layer in self.layers}
+        self.levels = self.build_levels()
+
+        self.rasters = {}
+        self.static_rasters = {}
+
+        #options chosen at each level for the previous state and the finished frame
+        self.level_keys = None
+        self.pixels = None
+
+        #composites below the groups changing most often, as many as fit in snapshot_budget bytes, see keep_snapshot
+        self.snapshot_budget = snapshot_budget
+        self.snapshots = [None] * len(self.levels)
+        self.change_counts = [0] * len(self.levels)
+
+    @property
+    def canvas_size(self):
+        left, top, right, bottom = self.canvas_box
+        return bottom - top, right - left
+
+    @property
+    def snapshot_capacity(self):
+        height, width = self.canvas_size
+        return self.snapshot_budget // (height * width * 4 * np.dtype(np.float32).itemsize)
+
+    def build_levels(self):
+        '''Splits the layer stack into runs of static layers and controllable groups, bottom to top'''
+
+        positions = [(self.stack_order[layer], None, layer) for layer in self.default_layers]
+
+        for group, group_options in self.psd_groups.items():
+            if len(group_options) != 0:
+                positions.append((min(map(self.stack_order.__getitem__, group_options.values())), group, None))
+
+        positions.sort(key=itemgetter(0))
+
+        levels = []
+
+        for _, group, layer in positions:
+            if group is None and len(levels) != 0 and levels[-1].is_static:
+                levels[-1].layers.append(layer)
+                continue
+
+            level = Level(group)
+
+            if group is None:
+                level.layers.append(layer)
+
+            levels.append(level)
+
+        return levels
+
+    def supports(self, layers):
+        '''Only normal blending is reproduced, anything else is left to psd_tools'''
+
+        return all(layer.blend_mode == BlendMode.NORMAL for layer in layers)
+
+    def get_raster(self, layer):
+        if layer in self.rasters:
+            return self.rasters[layer]
+
+        raster = None
+
+        if layer.bbox != (0, 0, 0, 0):
+            #Composing a single layer onto an empty context gives exactly what the full compose would blend in
+            pil_image = compose([layer], layer_filter=self.layers.__contains__, bbox=layer.bbox)
+
+            if pil_image is not None:
+                raster = LayerRaster.from_pil(pil_image, pil_image.info["offset"], self.factor)
+
+        self.rasters[layer] = raster
+
+        return raster
+
+    def get_static_raster(self, level):
+        if level not in self.static_rasters:
+            rasters = [self.get_raster(layer) for layer in level.layers]
+            self.static_rasters[level] = LayerRaster.flatten([raster for raster in rasters if raster is not None])
+
+        return self.static_rasters[level]
+
+    def chosen_layers(self, state):
+        options = dict(state)
+
+        for level in self.levels:
+            if level.is_static:
+                yield from level.layers
+            elif level.group in options:
+                yield self.psd_groups[level.group][options[level.group]]
+
+    def compose(self, state):
+        return Image.fromarray(self.compose_array(state))
+
+    def compose_array(self, state, out=None):
+        '''Composites the state into an RGBA uint8 array, written into out when it is given'''
+
+        if out is None:
+            out = np.empty(self.canvas_size + (4,), dtype=np.uint8)
+
+        wanted_layers = set(self.chosen_layers(state))
+
+        if not self.supports(wanted_layers):
+            pil_image = compose(list(self.psd.descendants()), layer_filter=wanted_layers.__contains__, bbox=self.psd.viewbox)
+
+            if self.factor == 1:
+                out[...] = np.asarray(pil_image.convert("RGBA"))
+            else:
+                left, top, _, _ = self.psd.viewbox
+                self.to_array(LayerRaster.from_pil(pil_image, (left, top), self.factor).pixels, out)
+
+            return out
+
+        options = dict(state)
+        level_keys = [None if level.is_static else options.get(level.group) for level in self.levels]
+
+        if self.level_keys is None:
+            first_changed, region = 0, self.canvas_box
+            self.pixels = np.empty(self.canvas_size + (4,), dtype=np.uint8)
+        else:
+            first_changed, region = self.get_dirty_region(level_keys)
+
+        if region is not None:
+            if first_changed != 0:
+                self.change_counts[first_changed] += 1
+                self.keep_snapshot(first_changed, level_keys)
+
+            self.recomposite(level_keys, first_changed, region)
+
+        self.level_keys = level_keys
+
+        out[...] = self.pixels
+
+        return out
+
+    def get_dirty_region(self, level_keys):
+        '''Lowest group whose option changed since the previous state, and the canvas box covering the old and new layers of every changed group'''
+
+        changed = [index for index, (previous, current) in enumerate(zip(self.level_keys, level_keys)) if previous != current]
+
+        if len(changed) == 0:
+            return None, None
+
+        bboxes = []
+
+        for index in changed:
+            group_options = self.psd_groups[self.levels[index].group]
+
+            for key in (self.level_keys[index], level_keys[index]):
+                raster = None if key is None else self.get_raster(group_options[key])
+
+                if raster is not None:
+                    bboxes.append(raster.bbox)
+
+        if len(bboxes) == 0:
+            return None, None
+
+        canvas_left, canvas_top, canvas_right, canvas_bottom = self.canvas_box
+        lefts, tops, rights, bottoms = zip(*bboxes)
+
+        left, top = max(min(lefts), canvas_left), max(min(tops), canvas_top)
+        right, bottom = min(max(rights), canvas_right), min(max(bottoms), canvas_bottom)
+
+        if right <= left or bottom <= top:
+            return None, None
+
+        return changed[0], (left, top, right, bottom)
+
+    def region_slice(self, region):
+        canvas_left, canvas_top, _, _ = self.canvas_box
+        left, top, right, bottom = region
+
+        return slice(top - canvas_top, bottom - canvas_top), slice(left - canvas_left, right - canvas_left)
+
+    def base_level(self, index):
+        '''Highest level at or below index with a snapshot to start compositing from, 0 to start from nothing'''
+
+        while index > 0 and self.snapshots[index] is None:
+            index -= 1
+
+        return index
+
+    def canvas_below(self, index, region):
+        left, top, right, bottom = region
+
+        if self.snapshots[index] is None:
+            return np.zeros((bottom - top, right - left, 4), dtype=np.float32)
+
+        return self.snapshots[index][self.region_slice(region)].copy()
+
+    def blend(self, canvas, region, level_keys, start, stop):
+        '''Blends levels start up to stop over the canvas covering region, refreshing the snapshots passed on the way'''
+
+        region_slice = self.region_slice(region)
+
+        for index in range(start, stop):
+            level = self.levels[index]
+
+            if level.is_static:
+                raster = self.get_static_raster(level)
+            else:
+                if self.snapshots[index] is not None:
+                    self.snapshots[index][region_slice] = canvas
+
+                key = level_keys[index]
+                raster = None if key is None else self.get_raster(self.psd_groups[level.group][key])
+
+            if raster is not None:
+                alpha_over(canvas, region, raster)
+
+    def keep_snapshot(self, index, level_keys):
+        '''Starts keeping the composite below a group level, if it changes more often than a group whose snapshot has to make room.
+
+        A full canvas float snapshot is large, about 130MB at 4K, so only the groups that changed most get one.'''
+
+        if self.snapshots[index] is not None:
+            return
+
+        held = [level for level, snapshot in enumerate(self.snapshots) if snapshot is not None]
+
+        if len(held) >= self.snapshot_capacity:
+            victim = min(held, key=self.change_counts.__getitem__, default=None)
+
+            if victim is None or self.change_counts[victim] >= self.change_counts[index]:
+                return
+
+            self.snapshots[victim] = None
+
+        base = self.base_level(index)
+        canvas = self.canvas_below(base, self.canvas_box)
+        self.blend(canvas, self.canvas_box, level_keys, base, index)
+
+        self.snapshots[index] = canvas
+
+    def recomposite(self, level_keys, first_changed, region):
+        '''Blends the levels from the nearest snapshot below first_changed upward inside region, refreshing the snapshots and the finished frame there'''
+
+        base = self.base_level(first_changed)
+        canvas = self.canvas_below(base, region)
+
+        self.blend(canvas, region, level_keys, base, len(self.levels))
+
+        self.to_array(canvas, self.pixels[self.region_slice(region)])
+
+    def to_array(self, canvas, out):
+        alpha = canvas[..., 3:]
+
+        #unpremultiply, fully transparent pixels keep the white backdrop psd_tools composes onto
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rgb = np.where(alpha > 0, canvas[..., :3] / alpha, 1)
+
+        out[..., :3] = np.rint(np.clip(rgb, 0, 1) * 255)
+        out[..., 3:] = np.rint(alpha * 255)
+
+        return out
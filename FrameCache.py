@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+from collections import OrderedDict
+
+class FrameCache:
+    '''LRU cache of decoded frames keyed by State, bounded by the total size of the frames in bytes'''
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.frames = OrderedDict()
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __contains__(self, key):
+        return key in self.frames
+
+    def __repr__(self):
+        return f"FrameCache(frames={len(self)}, size={self.size}, max_bytes={self.max_bytes})"
+
+    def get(self, key):
+        frame = self.frames.get(key)
+
+        if frame is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.frames.move_to_end(key)
+
+        return frame
+
+    def put(self, key, frame):
+        #frames that could never fit are not worth evicting everything else for
+        if frame.nbytes > self.max_bytes:
+            return
+
+        if key in self.frames:
+            self.size -= self.frames.pop(key).nbytes
+
+        self.frames[key] = frame
+        self.size += frame.nbytes
+
+        while self.size > self.max_bytes:
+            _, evicted = self.frames.popitem(last=False)
+            self.size -= evicted.nbytes
+            self.evictions += 1
+
+    def clear(self):
+        self.frames.clear()
+        self.size = 0
+
+    @property
+    def hit_ratio(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups != 0 else 0.0
+
+    @property
+    def stats(self):
+        return f"{self.hits} hits, {self.misses} misses, {self.evictions} evictions ({self.hit_ratio:.1%} hit ratio), {self.size / 2**20:.1f}MB held"
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+
+from contextlib import contextmanager
+from threading import Lock
+import hashlib
+import json
+import os
+
+try:
+    import fcntl
+except ImportError: #not available on windows
+    fcntl = None
+    import msvcrt
+
+from CacheBackends import PngBackend, PackBackend
+
+class ImageCache:
+    '''Image cache directory indexed by a manifest.
+
+    Entries are keyed by a hash of the psd contents, its layer set and the state, so editing
+    the psd never serves stale frames. The manifest is read once per run, making membership
+    tests O(1) instead of a glob over the directory.
+
+    Runs may share a cache directory. Saving the manifest merges it with the one on disk under a
+    lock file, so entries other runs saved since this one loaded are kept.
+
+    Frames are stored by a backend, png files or a memory mapped frame pack. Each entry is read
+    and deleted by the backend that wrote it, so switching formats keeps the existing frames.'''
+
+    manifest_name = "manifest.json"
+    lock_name = ".manifest.lock"
+    manifest_version = 1
+    chunk_size = 1 << 20
+
+    def __init__(self, args, image_source):
+        self.args = args
+        self.directory = args.directory
+        self.image_source = image_source
+
+        #previews get their own directory and manifest, they must never be served as full resolution frames
+        if args.preview_scale is not None:
+            self.directory = args.directory / f"preview_1x{image_source.downsample_factor}"
+            self.directory.mkdir(exist_ok=True)
+
+        self.png = PngBackend(self)
+        self.pack = PackBackend(self)
+        self.backend = self.pack if args.cache_format == "pack" else self.png
+
+        self.dirty = False
+
+        #entries and psd versions this run removed, which must not come back from the manifest on disk
+        self.removed = set()
+        self.invalidated = set()
+
+        #the lock file is held per process, threads of this one take turns through this lock
+        self.thread_lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+        self.load_manifest()
+
+    @property
+    def manifest_path(self):
+        return self.directory / self.manifest_name
+
+    def read_manifest(self):
+        '''The manifest on disk, an empty one when it is missing, unreadable or of another version'''
+
+        try:
+            with open(self.manifest_path) as file:
+                manifest = json.load(file)
+        except (FileNotFoundError, ValueError):
+            manifest = {}
+
+        if manifest.get("version") != self.manifest_version:
+            manifest = {"version": self.manifest_version, "sources": {}, "entries": {}}
+
+        manifest.setdefault("packs", {})
+
+        return manifest
+
+    def load_manifest(self):
+        manifest = self.read_manifest()
+
+        self.sources = manifest["sources"]
+        self.entries = manifest["entries"]
+        self.packs = manifest["packs"]
+
+        #newest entry for each state, used when no psd is given to key by
+        self.by_state = {entry["state"]: key for key, entry in self.entries.items()}
+
+        self.source_key = self.get_source_key() if self.args.psd_path is not None else None
+
+        #persist any invalidation straight away so the manifest never lists deleted files
+        self.save_manifest()
+
+    @contextmanager
+    def locked(self):
+        '''Holds the cache directory's lock file, so only one run at a time saves the manifest or allocates pack slots'''
+
+        with self.thread_lock, open(self.directory / self.lock_name, "a+b") as file:
+            if fcntl is not None:
+                fcntl.flock(file, fcntl.LOCK_EX)
+            else:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(file, fcntl.LOCK_UN)
+                else:
+                    file.seek(0)
+                    msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def merge(self, manifest):
+        '''Takes in what other runs saved to the manifest since it was loaded, this run's own changes win'''
+
+        entries = {key: entry for key, entry in manifest["entries"].items() if key not in self.removed and entry["source"] not in self.invalidated}
+        packs = {source_key: pack for source_key, pack in manifest["packs"].items() if source_key not in self.invalidated}
+
+        entries.update(self.entries)
+        packs.update(self.packs)
+        manifest["sources"].update(self.sources)
+
+        for key, entry in entries.items():
+            if key not in self.entries:
+                self.by_state.setdefault(entry["state"], key)
+
+        self.sources, self.entries, self.packs = manifest["sources"], entries, packs
+
+    def save_manifest(self):
+        #frames reach the disk before the manifest that lists them
+        self.pack.flush()
+
+        if not self.dirty:
+            return
+
+        with self.locked():
+            self.merge(self.read_manifest())
+
+            manifest = {"version": self.manifest_version, "sources": self.sources, "entries": self.entries, "packs": self.packs}
+
+            #write to the side and rename so a crash never leaves a truncated manifest
+            temp_path = self.manifest_path.with_name(f".{self.manifest_name}.{os.getpid()}.tmp")
+
+            with open(temp_path, "w") as file:
+                json.dump(manifest, file)
+
+            os.replace(temp_path, self.manifest_path)
+
+        self.dirty = False
+
+    def get_source_key(self):
+        '''Hash of the psd contents and the layer set derived from it, rehashing only when the file changed'''
+
+        psd_path = self.args.psd_path
+        path_key = str(psd_path.resolve())
+        stat = psd_path.stat()
+
+        source = self.sources.get(path_key)
+
+        if source is not None and source["size"] == stat.st_size and source["mtime_ns"] == stat.st_mtime_ns:
+            return source["key"]
+
+        digest = self.hash_file(psd_path)
+
+        layer_set = {group: sorted(options) for group, options in self.image_source.psd_groups.items()}
+        default_layers = sorted(layer.name for layer in self.image_source.default_layers)
+
+        hasher = hashlib.sha1(digest.encode())
+        hasher.update(json.dumps([layer_set, default_layers], sort_keys=True).encode())
+        source_key = hasher.hexdigest()
+
+        if source is not None and source["key"] != source_key:
+            self.invalidate(source["key"])
+
+        self.sources[path_key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "key": source_key}
+        self.dirty = True
+
+        return source_key
+
+    def hash_file(self, path):
+        hasher = hashlib.sha1()
+
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(self.chunk_size), b""):
+                hasher.update(chunk)
+
+        return hasher.hexdigest()
+
+    def invalidate(self, source_key):
+        '''Removes every entry rendered from an outdated version of a psd'''
+
+        if self.args.verbose:
+            print("psd file changed, invalidating its cached images")
+
+        stale = [key for key, entry in self.entries.items() if entry["source"] == source_key]
+
+        for key in stale:
+            self.remove(key)
+
+        self.invalidated.add(source_key)
+        self.pack.drop(source_key)
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+
+        if entry is None:
+            return
+
+        if self.by_state.get(entry["state"]) == key:
+            del self.by_state[entry["state"]]
+
+        self.removed.add(key)
+
+        self.backend_for(entry).delete(key, entry)
+        self.dirty = True
+
+    def backend_for(self, entry):
+        return self.pack if "slot" in entry else self.png
+
+    def key(self, state):
+        if self.source_key is None:
+            return self.by_state.get(state.canonical_name)
+
+        return hashlib.sha1(f"{self.source_key}:{state.canonical_name}".encode()).hexdigest()
+
+    def __contains__(self, state):
+        return self.key(state) in self.entries
+
+    def lookup(self, state):
+        '''Membership test of a state about to be read, the only one counted towards the hit ratio'''
+
+        found = state in self
+
+        if found:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+        return found
+
+    def path(self, state):
+        '''Where the png of a state lives when it is stored as a png'''
+        return self.png.path(self.key(state))
+
+    def add(self, state):
+        '''Records a state and reserves its storage, its pixels are stored afterwards with write'''
+
+        key = self.key(state)
+
+        self.entries[key] = {"state": state.canonical_name, "source": self.source_key, **self.backend.allocate(key)}
+        self.by_state[state.canonical_name] = key
+        self.dirty = True
+
+    def write(self, state, pixels):
+        '''Stores the RGBA pixels of an added state, safe to call from writer threads'''
+
+        key = self.key(state)
+        entry = self.entries[key]
+
+        self.backend_for(entry).write(key, entry, pixels)
+
+    def read(self, state):
+        '''BGR frame of a cached state, or None when its storage went missing'''
+
+        key = self.key(state)
+        entry = self.entries[key]
+
+        return self.backend_for(entry).read(key, entry)
+
+    def discard(self, state):
+        key = self.key(state)
+
+        if key is not None:
+            self.remove(key)
@@ -1,37 +1,52 @@
 #!/usr/bin/env python
 
-from psd_tools import PSDImage, compose
+from psd_tools import PSDImage
 import numpy as np
 import cv2
 
-from functools import cached_property, lru_cache, partial
+from functools import cached_property
+from itertools import chain
+from collections import deque
+from contextlib import contextmanager, nullcontext
 
-from multiprocessing.pool import Pool as ProcessPool
-from concurrent.futures import ThreadPoolExecutor as ThreadPool
-
-import signal
-
-def ignore_signal():
-    """Ignore CTRL+C in the worker process."""
-
-    signal.signal(signal.SIGINT, signal.SIG_IGN)
+from Compositor import Compositor, scale_box
+from ImageCache import ImageCache
+from FrameCache import FrameCache
+from RenderPool import RenderPool
+from CacheWriter import CacheWriter
+from Profiler import get_profiler
 
 class ImageSource:
 
     ignore_character = "__"
 
+    #how many timeline states stream_frames reads ahead looking for work for the render pool
+    lookahead_limit = 256
+
     def __init__(self, args):
         self.args = args
-        self.psd = PSDImage.open(args.psd_path) if args.psd_path is not None else None
+
+        with get_profiler().stage("open_psd"):
+            self.psd = PSDImage.open(args.psd_path) if args.psd_path is not None else None
+
         self.default_layers = set()
+        self.frame_cache = FrameCache(args.frame_cache_mb * 2**20)
 
-    def current_directory_contents(self):
-        return set(file.name for file in self.args.directory.glob("*.png"))
+        #a resident image source keeps its render pool between runs instead of starting one per run
+        self.resident = False
+        self.resident_pool = None
+
+        #writer of the run in progress, reads of a state still being written wait for it
+        self.cache_writer = None
 
     @cached_property
     def psd_groups(self):
         '''Creates a mapping from group names to layer names to layers: group_name -> (layer_name -> layer)'''
 
+        with get_profiler().stage("psd_groups"):
+            return self.build_psd_groups()
+
+    def build_psd_groups(self):
         psd_groups = {}
 
         for group in self.psd:
@@ -57,50 +72,233 @@ class ImageSource:
 
         return psd_groups
 
+    @cached_property
+    def cache(self):
+        return ImageCache(self.args, self)
+
+    @cached_property
+    def compositor(self):
+        return Compositor(self.psd, self.psd_groups, self.default_layers, self.downsample_factor, self.args.snapshot_mb * 2**20)
+
+    @property
+    def downsample_factor(self):
+        '''Previews composite on a grid this many times coarser than the psd'''
+
+        if self.args.preview_scale is None:
+            return 1
+
+        return round(1 / self.args.preview_scale)
+
+    @property
+    def frame_shape(self):
+        left, top, right, bottom = scale_box(self.psd.viewbox, self.downsample_factor)
+        return (bottom - top, right - left, 4)
+
+    def get_region(self, options):
+        '''Union bbox of the layers for the given (setting, option) pairs in frame coordinates, or None if they cover nothing'''
+
+        if self.psd is None:
+            raise RuntimeError("Finding the changing region of the animation requires a psd file.")
+
+        factor = self.downsample_factor
+        canvas_left, canvas_top, canvas_right, canvas_bottom = scale_box(self.psd.viewbox, factor)
+
+        bboxes = [self.psd_groups[setting][option].bbox for setting, option in options]
+        bboxes = [scale_box(bbox, factor) for bbox in bboxes if bbox != (0, 0, 0, 0)]
+
+        if len(bboxes) == 0:
+            return None
+
+        lefts, tops, rights, bottoms = zip(*bboxes)
+
+        left, top = max(min(lefts), canvas_left), max(min(tops), canvas_top)
+        right, bottom = min(max(rights), canvas_right), min(max(bottoms), canvas_bottom)
+
+        if right <= left or bottom <= top:
+            return None
+
+        return left - canvas_left, top - canvas_top, right - canvas_left, bottom - canvas_top
+
+    @contextmanager
+    def render_pool(self):
+        if not self.resident:
+            with RenderPool(self) as render_pool:
+                yield render_pool
+
+            return
+
+        if self.resident_pool is None:
+            self.resident_pool = RenderPool(self)
+
+        try:
+            yield self.resident_pool
+        except BaseException:
+            #renders may still be in flight and holding slots, start over with a fresh pool next time
+            self.resident_pool.close(terminate=True)
+            self.resident_pool = None
+
+            raise
+
+    def close(self):
+        if self.resident_pool is not None:
+            self.resident_pool.close()
+            self.resident_pool = None
+
     def create_frames(self, states):
 
-        self.validate_states(states)
+        #the whole timeline is validated first, an invalid state must not stop a run with frames half written
+        states_to_be_created = self.get_nonexistent_states(self.validate_states(states))
 
-        states_to_be_created = self.get_nonexistent_states(states)
+        #peek so the worker pool is only started when something is missing
+        first_state = next(states_to_be_created, None)
 
-        if len(states_to_be_created) != 0 and self.psd is None:
+        if first_state is None:
+            return
+
+        if self.psd is None:
             raise RuntimeError("Need to generate states but no psd file supplied.")
+
+        states_to_be_created = chain([first_state], states_to_be_created)
     
-        #ProcessPool for CPU bound image creation, ThreadPool for IO bound file saving
-        with ProcessPool(initializer=ignore_signal) as process_pool, ThreadPool() as thread_pool:
-            try:
-                for image, state in process_pool.imap_unordered(self.generate_image, states_to_be_created):
-                    save_image = partial(image.save, self.args.directory / state.filename)
-                    thread_pool.submit(save_image)
-            except KeyboardInterrupt:
-                process_pool.terminate()
-                thread_pool.shutdown(wait=False)
-
-                raise KeyboardInterrupt from None
+        #RenderPool for CPU bound image creation, CacheWriter for IO bound saving
+        with self.render_pool() as render_pool, self.writing() as cache_writer:
+            for state, pixels in render_pool.render(states_to_be_created):
+                cache_writer.submit(state, pixels.copy())
+
+            del pixels
+
+    @contextmanager
+    def writing(self):
+        '''CacheWriter for one run, the manifest is saved even when the run fails so it never lists unwritten frames'''
+
+        self.cache_writer = CacheWriter(self.cache, self.args.cache_write_queue)
+
+        try:
+            with self.cache_writer as cache_writer:
+                yield cache_writer
+        finally:
+            self.cache_writer = None
+            self.cache.save_manifest()
+
+    def stream_frames(self, states):
+        '''Yields frames in timeline order, rendering missing states in the render pool as the stream reaches them.
+
+        Rendered frames skip the PNG round trip, writing them to the image cache happens on the side.
+        In flight renders are bounded by the render pool's slots, which bounds the buffer used to put results back in order.'''
+
+        states = iter(states)
+        lookahead = deque()
+        pending = {}
+
+        render_pool = self.render_pool() if self.psd is not None else nullcontext()
+
+        with render_pool as render_pool, self.writing() as cache_writer:
+
+            def fill_lookahead():
+                while len(lookahead) < self.lookahead_limit:
+                    if self.psd is not None and not render_pool.has_free_slot:
+                        return
+
+                    state = next(states, None)
+
+                    if state is None:
+                        return
+
+                    lookahead.append(state)
+
+                    #cached states are counted as hits once get_image reads them
+                    if state in pending or state in self.frame_cache or state in self.cache:
+                        continue
+
+                    if self.psd is None:
+                        raise RuntimeError("Need to generate states but no psd file supplied.")
+
+                    self.cache.misses += 1
+
+                    state.validate(self.psd_groups)
+                    pending[state] = render_pool.submit(state)
+
+            fill_lookahead()
+
+            while len(lookahead) != 0:
+                state = lookahead.popleft()
+
+                if state in pending:
+                    slot_name = render_pool.wait(pending.pop(state))
+
+                    pixels = render_pool.pixels(slot_name)
+
+                    if self.args.store_new:
+                        cache_writer.submit(state, pixels.copy())
+
+                    frame = cv2.cvtColor(pixels, cv2.COLOR_RGBA2BGR)
+                    self.frame_cache.put(state, frame)
+
+                    del pixels
+                    render_pool.release(slot_name)
+                else:
+                    frame = self.get_image(state)
+
+                fill_lookahead()
+
+                yield frame
 
     def validate_states(self, states):
-        for state in states:
+        '''Validates every distinct state before anything is rendered and returns them in order of first appearance.
+
+        Only distinct states are held, a long timeline repeating a few states stays small.'''
+
+        distinct_states = list(dict.fromkeys(states))
+
+        for state in distinct_states:
             state.validate(self.psd_groups)
 
+        return distinct_states
+
     def get_nonexistent_states(self, states):
-        current_files = self.current_directory_contents()
-        needed_states = (state for state in states if state.filename not in current_files)
-        required = list(dict.fromkeys(needed_states)) #removes duplicates, keep order
+        '''Yields each state missing from the image cache once, in order of first appearance'''
+
+        seen = set()
+
+        for state in states:
+            if state in seen:
+                continue
+
+            seen.add(state)
 
-        return required
+            if state not in self.cache:
+                yield state
 
-    @lru_cache
     def get_image(self, state):
 
+        image = self.frame_cache.get(state)
+
+        if image is None:
+            image = self.load_image(state)
+            self.frame_cache.put(state, image)
+
+        return image
+
+    def load_image(self, state):
+
         state.validate(self.psd_groups)
 
-        #First check if it already exists in the directory if it was given
-        if state.filename in self.current_directory_contents():
+        if self.cache_writer is not None:
+            self.cache_writer.wait(state)
+
+        #First check if it already exists in the image cache
+        if self.cache.lookup(state):
 
             if self.args.verbose:
                 print("Found cached image")
 
-            return cv2.imread(str(self.args.directory / state.filename))
+            image = self.cache.read(state)
+
+            if image is not None:
+                return image
+
+            #the file went missing from under the manifest
+            self.cache.discard(state)
 
         #otherwise we revert to using the psd file
         image, _ = self.generate_image(state)
@@ -115,7 +313,15 @@ class ImageSource:
         if self.args.verbose:
             print("Generating new image")
         
-        wanted_layers = set(self.psd_groups[option][value] for option, value in state) | self.default_layers
-        pil_image = compose(list(self.psd.descendants()), layer_filter=wanted_layers.__contains__, bbox=self.psd.viewbox)
+        with get_profiler().frame("composite"):
+            pil_image = self.compositor.compose(state)
 
         return pil_image, state
+
+    def render_into(self, state, pixels):
+        '''Composites a state as RGBA into the given array'''
+
+        if self.args.verbose:
+            print("Generating new image")
+
+        self.compositor.compose_array(state, out=pixels)
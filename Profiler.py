@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from time import perf_counter, process_time
+import json
+import sys
+
+try:
+    import resource
+except ImportError: #not available on windows
+    resource = None
+
+def peak_rss():
+    '''Peak resident set size in bytes of this process and of its waited-for children, None where unsupported'''
+
+    if resource is None:
+        return None
+
+    #ru_maxrss is in kilobytes on linux but bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+
+    return {"self": own, "children": children}
+
+class NullProfiler:
+    '''Stand-in used when profiling is disabled, every hook is a no-op'''
+
+    enabled = False
+
+    _null_context = nullcontext()
+
+    def stage(self, name):
+        return self._null_context
+
+    def frame(self, name):
+        return self._null_context
+
+    def add_latency(self, name, seconds):
+        pass
+
+    def count(self, name, amount=1):
+        pass
+
+    def record_cache(self, name, hits, misses):
+        pass
+
+    def report(self, path):
+        pass
+
+class Profiler:
+    '''Records wall and CPU time and peak RSS per stage, per frame latency histograms and cache hit ratios'''
+
+    enabled = True
+
+    #upper bounds in ms of the latency histogram buckets
+    buckets = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+    def __init__(self):
+        self.stages = {}
+        self.stage_order = []
+        self.latencies = defaultdict(list)
+        self.counters = defaultdict(int)
+        self.caches = {}
+
+    @contextmanager
+    def stage(self, name):
+        wall_start, cpu_start = perf_counter(), process_time()
+
+        try:
+            yield
+        finally:
+            wall, cpu = perf_counter() - wall_start, process_time() - cpu_start
+
+            if name not in self.stages:
+                self.stage_order.append(name)
+                self.stages[name] = {"calls": 0, "wall": 0.0, "cpu": 0.0}
+
+            stage = self.stages[name]
+            stage["calls"] += 1
+            stage["wall"] += wall
+            stage["cpu"] += cpu
+            stage["peak_rss"] = peak_rss()
+
+    @contextmanager
+    def frame(self, name):
+        start = perf_counter()
+
+        try:
+            yield
+        finally:
+            #list.append is atomic, so frames timed on worker threads can share the list
+            self.latencies[name].append(perf_counter() - start)
+
+    def add_latency(self, name, seconds):
+        '''Records a frame timed elsewhere, like compositing inside a render worker'''
+        self.latencies[name].append(seconds)
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def record_cache(self, name, hits, misses):
+        lookups = hits + misses
+        self.caches[name] = {"hits": hits, "misses": misses, "hit_ratio": hits / lookups if lookups != 0 else None}
+
+    def histogram(self, samples):
+        samples = sorted(samples)
+        count = len(samples)
+
+        def percentile(fraction):
+            return samples[min(count - 1, int(fraction * count))] * 1000
+
+        bucket_counts = [0] * (len(self.buckets) + 1)
+
+        for sample in samples:
+            milliseconds = sample * 1000
+            index = next((index for index, bound in enumerate(self.buckets) if milliseconds < bound), len(self.buckets))
+            bucket_counts[index] += 1
+
+        labels = [f"<{bound}ms" for bound in self.buckets] + [f">={self.buckets[-1]}ms"]
+
+        return {
+            "count": count,
+            "total_s": sum(samples),
+            "mean_ms": sum(samples) / count * 1000,
+            "p50_ms": percentile(0.5),
+            "p90_ms": percentile(0.9),
+            "p99_ms": percentile(0.99),
+            "max_ms": samples[-1] * 1000,
+            "buckets": dict(zip(labels, bucket_counts)),
+        }
+
+    @property
+    def results(self):
+        return {
+            "stages": {name: self.stages[name] for name in self.stage_order},
+            "frames": {name: self.histogram(samples) for name, samples in self.latencies.items() if len(samples) != 0},
+            "caches": self.caches,
+            "counters": dict(self.counters),
+            "peak_rss": peak_rss(),
+        }
+
+    def summary(self, results):
+        lines = ["Profile:", f"  {'stage':<24}{'calls':>7}{'wall s':>10}{'cpu s':>10}"]
+
+        for name, stage in results["stages"].items():
+            lines.append(f"  {name:<24}{stage['calls']:>7}{stage['wall']:>10.3f}{stage['cpu']:>10.3f}")
+
+        if len(results["frames"]) != 0:
+            lines.append(f"  {'per frame':<24}{'count':>7}{'mean ms':>10}{'p90 ms':>10}{'max ms':>10}")
+
+            for name, histogram in results["frames"].items():
+                lines.append(f"  {name:<24}{histogram['count']:>7}{histogram['mean_ms']:>10.2f}{histogram['p90_ms']:>10.2f}{histogram['max_ms']:>10.2f}")
+
+        for name, cache in results["caches"].items():
+            ratio = "n/a" if cache["hit_ratio"] is None else f"{cache['hit_ratio']:.1%}"
+            lines.append(f"  {name}: {cache['hits']} hits, {cache['misses']} misses ({ratio})")
+
+        rss = results["peak_rss"]
+
+        if rss is not None:
+            lines.append(f"  peak rss: {rss['self'] / 2**20:.1f}MB (workers {rss['children'] / 2**20:.1f}MB)")
+
+        return "\n".join(lines)
+
+    def report(self, path):
+        results = self.results
+
+        print(self.summary(results))
+
+        with open(path, "w") as file:
+            json.dump(results, file, indent=4)
+
+_profiler = NullProfiler()
+
+def init_profiler(args):
+    global _profiler
+    _profiler = Profiler() if args.profile is not None else NullProfiler()
+
+def get_profiler():
+    global _profiler
+    return _profiler
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+from collections import deque
+from multiprocessing.pool import Pool as ProcessPool
+from multiprocessing.shared_memory import SharedMemory
+from os import cpu_count
+
+from time import perf_counter
+import signal
+
+from State import State
+from Profiler import get_profiler
+
+def ignore_signal():
+    """Ignore CTRL+C in the worker process."""
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+#Each worker opens the psd once and keeps its own image source, so layer rasters survive between states
+worker_image_source = None
+worker_slots = {}
+
+def init_worker(source_class, args):
+    global worker_image_source
+
+    ignore_signal()
+    worker_image_source = source_class(args)
+
+def render_in_worker(state_items, slot_name, shape):
+    '''Renders a state straight into a shared memory slot owned by the parent, returns the slot and the seconds spent compositing'''
+
+    if slot_name not in worker_slots:
+        worker_slots[slot_name] = SharedMemory(name=slot_name)
+
+    pixels = np.ndarray(shape, dtype=np.uint8, buffer=worker_slots[slot_name].buf)
+
+    #workers have no profiler of their own, the parent records the timing when it collects the result
+    start = perf_counter()
+    worker_image_source.render_into(State(dict(state_items)), pixels)
+
+    return slot_name, perf_counter() - start
+
+class RenderPool:
+    '''Process pool whose workers hold their own parsed psd.
+
+    Workers only receive the state's options and write pixels into shared memory slots that the
+    parent reads without copying. Every in flight render holds a slot, so the number of slots bounds
+    how far rendering can run ahead of the consumer.'''
+
+    def __init__(self, image_source, processes=None):
+        self.processes = processes or cpu_count() or 1
+        self.shape = image_source.frame_shape
+
+        size = int(np.prod(self.shape))
+        self.slots = {}
+
+        for _ in range(self.processes * 2):
+            slot = SharedMemory(create=True, size=size)
+            self.slots[slot.name] = slot
+
+        self.free_slots = list(self.slots)
+
+        self.pool = ProcessPool(self.processes, initializer=init_worker, initargs=(type(image_source), image_source.args))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(terminate=exc_type is not None)
+
+    @property
+    def has_free_slot(self):
+        return len(self.free_slots) != 0
+
+    def submit(self, state):
+        '''Starts rendering a state, the returned result resolves to the name of its slot'''
+
+        slot_name = self.free_slots.pop()
+
+        return self.pool.apply_async(render_in_worker, (tuple(state), slot_name, self.shape))
+
+    def wait(self, result):
+        '''Name of the slot a submitted render resolves to, once it is done.
+
+        render_wait is the time the consumer was blocked, the compositing time measured in the worker is recorded as composite.'''
+
+        profiler = get_profiler()
+
+        with profiler.frame("render_wait"):
+            slot_name, seconds = result.get()
+
+        profiler.add_latency("composite", seconds)
+
+        return slot_name
+
+    def pixels(self, slot_name):
+        '''RGBA view of a slot, only valid until the slot is released'''
+
+        return np.ndarray(self.shape, dtype=np.uint8, buffer=self.slots[slot_name].buf)
+
+    def release(self, slot_name):
+        self.free_slots.append(slot_name)
+
+    def render(self, states):
+        '''Yields (state, pixels) in the order given, pixels is only valid until the next item is requested'''
+
+        states = iter(states)
+        pending = deque()
+
+        while True:
+            while self.has_free_slot:
+                state = next(states, None)
+
+                if state is None:
+                    break
+
+                pending.append((state, self.submit(state)))
+
+            if len(pending) == 0:
+                return
+
+            state, result = pending.popleft()
+            slot_name = self.wait(result)
+
+            try:
+                yield state, self.pixels(slot_name)
+            finally:
+                self.release(slot_name)
+
+    def close(self, terminate=False):
+        if terminate:
+            self.pool.terminate()
+        else:
+            self.pool.close()
+
+        self.pool.join()
+
+        for slot in self.slots.values():
+            try:
+                slot.close()
+            except BufferError:
+                #a consumer still holds a view, the memory is freed once that goes away
+                pass
+
+            slot.unlink()
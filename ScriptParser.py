@@ -1,17 +1,30 @@
 #!/usr/bin/env python
 
-from importlib import import_module
+from importlib import invalidate_caches
+from importlib.util import spec_from_file_location, module_from_spec
+from pathlib import Path
+import random
 import sys
 
 import API
 import tools
+from Profiler import get_profiler
+from TimelineCache import TimelineCache
 
 class ScriptParser:
+
+    #the last script imported by any parser and its directory, shared so batch jobs do not see each other's modules
+    imported_name = None
+    imported_directory = None
+
     def __init__(self, args):
         self.args = args
         self.script_path = args.script_path
-        
-        API.init_api(args)
+        self.timeline_cache = TimelineCache(args)
+        self.dependencies = []
+
+        #whether the last run of the script may compile differently next time, see TimelineCache.volatile_modules
+        self.volatile = False
 
     def get_script(self):
         
@@ -23,15 +36,61 @@ class ScriptParser:
 
     def import_script(self):
         #dynamic module importing is a bit gross
-        sys.path.insert(0, str(self.script_path.resolve().parents[0]))
-        script = import_module(str(self.script_path.stem))
+        script_directory = self.script_path.resolve().parent
+
+        self.unload_script_modules()
+
+        #the script's own directory goes first, so its local modules win over same named ones elsewhere
+        if str(script_directory) in sys.path:
+            sys.path.remove(str(script_directory))
+
+        sys.path.insert(0, str(script_directory))
+        #loaded from its path, a module of the same name imported from another directory is never reused
+        module_name = self.script_path.stem
+        spec = spec_from_file_location(module_name, self.script_path.resolve())
+        script = module_from_spec(spec)
+        sys.modules[module_name] = script
+
+        ScriptParser.imported_name = module_name
+        ScriptParser.imported_directory = script_directory
+
+        spec.loader.exec_module(script)
 
         #Make the API functions and AnimTools inherently available to scripts
-        script.__dict__.update(API.__dict__)
+        #module attributes like __name__ and __file__ stay the script's own
+        script.__dict__.update({name: value for name, value in API.__dict__.items() if not name.startswith("__")})
         script.__dict__["AnimTools"] = tools.AnimTools
 
         return script
 
+    def unload_script_modules(self):
+        '''Forgets the script and the modules imported from next to it or the previously imported script, so running it again picks up edits'''
+
+        script_directory = self.script_path.resolve().parent
+        previous_directory = ScriptParser.imported_directory
+
+        #scripts living next to AutoAnim share a directory with the API, which must stay loaded
+        api_directory = Path(__file__).resolve().parent
+
+        directories = {script_directory, previous_directory} - {None, api_directory}
+
+        #the previous script may live elsewhere, e.g. a batch job's script with the same name in another directory
+        if ScriptParser.imported_name is not None:
+            sys.modules.pop(ScriptParser.imported_name, None)
+
+        for name, module in list(sys.modules.items()):
+            module_file = getattr(module, "__file__", None)
+
+            if module_file is not None and Path(module_file).resolve().parent in directories:
+                del sys.modules[name]
+
+        #modules of the previous script's directory must not shadow this one's
+        if previous_directory not in (None, script_directory, api_directory) and str(previous_directory) in sys.path:
+            sys.path.remove(str(previous_directory))
+
+        #make sure files written since the last import are noticed
+        invalidate_caches()
+
     def setup_script(self, script):
         if not hasattr(script, "main"):
             raise SyntaxError("Scripts must define a 'main' function")
@@ -41,29 +100,69 @@ class ScriptParser:
         API.set_current_context(script.main)
 
     def parse_script(self):
+        '''Returns the dict of time:option pairs, from a compiled timeline when the script has not changed'''
+
+        if self.args.timeline_path is not None:
+            if self.args.verbose:
+                print(f"Loading timeline {self.args.timeline_path}")
+
+            self.dependencies = [self.args.timeline_path]
+
+            return self.timeline_cache.load_file(self.args.timeline_path)
+
+        if self.args.timeline_cache:
+            temporal_dict = self.timeline_cache.load(self.script_path)
+
+            if temporal_dict is not None:
+                self.dependencies = [self.script_path, *self.timeline_cache.dependencies]
+                return temporal_dict
+
+        temporal_dict = self.run_script()
+
+        self.dependencies = [self.script_path, *TimelineCache.local_modules(self.script_path)]
+
+        if self.args.timeline_cache and not self.volatile:
+            self.timeline_cache.save(self.script_path, temporal_dict)
+        elif self.args.timeline_cache and self.args.verbose:
+            print("Script uses randomness, the time or the environment, not caching its timeline")
+
+        return temporal_dict
+
+    def run_script(self):
 
         verbose = self.args.verbose
+        profiler = get_profiler()
+
+        API.init_api(self.args)
 
         if verbose:
             print("Setting up script environment")
 
-        script = self.get_script()
+        with profiler.stage("import_script"):
+            script = self.get_script()
 
         if verbose:
             print("Executing script")
 
-        script.main()
+        #AnimTools.random and the random module draw from the shared generator, any draw changes its state
+        random_state = random.getstate()
+
+        with profiler.stage("execute_script"):
+            script.main()
 
         if verbose:
             print("Finished main")
 
         #All open loops get implicitly stopped at the end of main()
-        for func in API.get_waiting_funcs():
+        with profiler.stage("stop_loops"):
+            for func in API.get_waiting_funcs():
+
+                if verbose:
+                    print("Implicitly stopping unstopped loop")
 
-            if verbose:
-                print("Implicitly stopping unstopped loop")
+                func.stop(should_wait=False)
 
-            func.stop(should_wait=False)
+        self.volatile = random.getstate() != random_state or TimelineCache.uses_volatile_modules(self.script_path)
 
         model = API.get_model()
         model.finish()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+from concurrent.futures import ThreadPoolExecutor as ThreadPool
+from collections import deque
+import numpy as np
+
+import cv2
+
+from TextureAtlas import TextureAtlas
+from Profiler import get_profiler
+
+class VideoSink:
+    '''Encodes every frame into a video file, the writer is sized from the first frame'''
+
+    kind = "video"
+
+    #whether the sink only needs the first frame of each distinct state
+    distinct_only = False
+
+    def __init__(self, args, path):
+        self.args = args
+        self.path = path
+        self.codec = cv2.VideoWriter_fourcc(*args.codec)
+        self.writer = None
+
+    def add(self, state, frame):
+        if self.writer is None:
+            height, width, _ = frame.shape
+
+            if self.args.verbose:
+                print(f"Writing frames to video {self.path}")
+
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.writer = cv2.VideoWriter(str(self.path), self.codec, self.args.fps, (width, height))
+
+        with get_profiler().frame("video_write"):
+            self.writer.write(frame)
+
+    def close(self):
+        if self.writer is not None:
+            cv2.destroyAllWindows()
+            self.writer.release()
+
+    abort = close
+
+class FrameSequenceSink:
+    '''Writes every frame as a numbered png into a directory, encoding happens on a thread pool'''
+
+    kind = "frames"
+    distinct_only = False
+
+    #frames queued for encoding before the sink waits for the oldest
+    pending_limit = 64
+
+    def __init__(self, args, path):
+        self.args = args
+        self.path = path
+        self.index = 0
+        self.thread_pool = ThreadPool()
+        self.pending = deque()
+
+        path.mkdir(parents=True, exist_ok=True)
+
+        if args.verbose:
+            print(f"Writing frames to {path}")
+
+    def add(self, state, frame):
+        #frames handed to sinks are never written to afterwards, so the pool can encode them without a copy
+        self.pending.append(self.thread_pool.submit(self.write, self.path / f"{self.index:05d}.png", frame))
+        self.index += 1
+
+        #surface write errors as they happen rather than at the end, and bound the frames held by the queue
+        while len(self.pending) != 0 and (self.pending[0].done() or len(self.pending) > self.pending_limit):
+            self.pending.popleft().result()
+
+    @staticmethod
+    def write(path, frame):
+        with get_profiler().frame("frame_write"):
+            if not cv2.imwrite(str(path), frame):
+                raise OSError(f"Could not write frame {path}")
+
+    def close(self):
+        self.thread_pool.shutdown(wait=True)
+
+        for future in self.pending:
+            future.result()
+
+    def abort(self):
+        self.thread_pool.shutdown(wait=False, cancel_futures=True)
+
+class TextureSink:
+    '''Tiles frames into a texture atlas.
+
+    Deduplicated textures hold one tile per distinct state and a sidecar mapping timeline frames to tiles,
+    they take the timeline's states up front. Trimmed textures only hold the region that changes and save
+    the rest once as a base image.'''
+
+    kind = "texture"
+
+    def __init__(self, args, path, frame_count, states=None, region=None):
+        self.args = args
+        self.path = path
+        self.region = region
+        self.distinct_only = args.texture_dedupe
+
+        if args.texture_dedupe:
+            self.tiles, self.runs = self.deduplicate(states)
+            frame_count = len(self.tiles)
+        else:
+            self.tiles = None
+            self.runs = [[index, 1] for index in range(frame_count)] if region is not None else None
+
+        if args.verbose:
+            print(f"Creating texture {path} from {frame_count} frames")
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.atlas = TextureAtlas(args, frame_count, path)
+        self.index = 0
+
+    @staticmethod
+    def deduplicate(states):
+        '''Maps each distinct state to a tile index in order of appearance, and run-length encodes the timeline as [tile, frame count] runs'''
+
+        tiles = {}
+        runs = []
+
+        for state in states:
+            tile = tiles.setdefault(state, len(tiles))
+
+            if len(runs) != 0 and runs[-1][0] == tile:
+                runs[-1][1] += 1
+            else:
+                runs.append([tile, 1])
+
+        return tiles, runs
+
+    def add(self, state, frame):
+        if self.tiles is not None:
+            #repeats of a state already in the atlas only show up in the sidecar
+            if self.tiles[state] != self.index:
+                return
+
+        if self.region is not None:
+            if self.index == 0:
+                self.atlas.save_base(frame)
+
+            left, top, right, bottom = self.region
+            frame = np.ascontiguousarray(frame[top:bottom, left:right])
+
+        self.atlas.add(self.index, frame)
+        self.index += 1
+
+    def close(self):
+        if self.runs is not None:
+            self.atlas.save_sidecar(self.runs, self.region)
+
+        self.atlas.save()
+
+    def abort(self):
+        self.atlas.close()
@@ -1,42 +1,64 @@
 from operator import itemgetter
+from weakref import WeakValueDictionary
 
 class State:
+    '''Immutable mapping of setting -> option.
+
+    States are interned by value, so building the same state again returns the existing object.
+    The canonical name and hash are computed once when a state is first created.'''
+
+    __slots__ = ("items", "canonical_name", "_hash", "__weakref__")
 
     extension = "png"
 
-    def __init__(self, data):
+    _interned = WeakValueDictionary()
+
+    def __new__(cls, data):
+        items = tuple(sorted(data.items(), key=itemgetter(0))) if data else ()
+
+        state = cls._interned.get(items)
+
+        if state is not None:
+            return state
+
+        state = super().__new__(cls)
+        state.items = items
+        state.canonical_name = cls.make_canonical_name(items)
+        state._hash = hash(state.canonical_name)
 
-        if data is None:
-            self.data = dict()
+        cls._interned[items] = state
 
-        elif isinstance(data, dict):
-            self.data = data.copy()
+        return state
+
+    def __reduce__(self):
+        return (State, (self.data,))
 
     def __repr__(self):
         return repr(self.data)
 
     def __hash__(self):
-        return hash(self.canonical_name)
+        return self._hash
 
     def __eq__(self, other):
-        return type(self) == type(other) and self.canonical_name == other.canonical_name
+        return self is other or (type(self) == type(other) and self.canonical_name == other.canonical_name)
 
     def __iter__(self):
-        return iter(self.data.items())
+        return iter(self.items)
+
+    @property
+    def data(self):
+        return dict(self.items)
 
     @property
     def filename(self):
         return f"{self.canonical_name}.{self.extension}"
 
-    @property
-    def canonical_name(self):
+    @staticmethod
+    def make_canonical_name(items):
         '''Canonical name is lowercase key-value pairs seperated by underscores _ sorted by the key'''
 
         parts = []
 
-        items = list(self.data.items())
-        items.sort(key=itemgetter(0))
-
         for key, value in items:
             key   = key.lower().strip()
             value = value.lower().strip()
@@ -46,14 +68,14 @@ class State:
         return "_".join(parts)
 
     def validate(self, psd_groups):
-        for key, value in self.data.items():
+        for key, value in self.items:
             if key not in psd_groups:
                 raise KeyError(f"Received invalid key value: {key}:{value}")
 
             if value not in psd_groups[key]:
                 raise ValueError(f"Received invalid option value: {key}:{value}")
 
-        undefined_keys = set(psd_groups.keys()) - set(self.data.keys())
+        undefined_keys = set(psd_groups.keys()) - set(key for key, _ in self.items)
 
         if len(undefined_keys) != 0:
-            raise ValueError(f"All settings must be specified during the first frame. Currently missing: {undefined_keys!r}")
\ No newline at end of file
+            raise ValueError(f"All settings must be specified during the first frame. Currently missing: {undefined_keys!r}")
@@ -1,13 +1,88 @@
-
+from bisect import bisect_left, bisect_right
+from fractions import Fraction
+from math import floor
 from collections import defaultdict
 from operator import itemgetter
+import numpy as np
+
 from State import State
 
+class Periodic:
+    '''Events of a loop that repeats the same pattern count times, period ms apart.
+
+    pattern is a list of [offset, {setting: option}] in offset order, every offset smaller than period.
+    Iteration k puts each option at start + k * period + offset, which is how the events are expanded.'''
+
+    __slots__ = ("start", "period", "count", "pattern", "settings")
+
+    def __init__(self, start, period, count, pattern):
+        self.start = start
+        self.period = period
+        self.count = count
+        self.pattern = pattern
+        self.settings = {setting for _, options in pattern for setting in options}
+
+    @property
+    def min_time(self):
+        return self.start + self.pattern[0][0]
+
+    @property
+    def max_time(self):
+        return self.start + (self.count - 1) * self.period + self.pattern[-1][0]
+
+    def event_count(self):
+        return self.count * len(self.pattern)
+
+    def collisions(self, times):
+        '''(time, options) of the pattern entries landing exactly on any of the given times'''
+
+        for time in times:
+            if not self.min_time <= time <= self.max_time:
+                continue
+
+            for offset, options in self.pattern:
+                iteration = round((time - self.start - offset) / self.period)
+
+                if 0 <= iteration < self.count and self.start + iteration * self.period + offset == time:
+                    yield time, options
+
+    def track(self, setting, codes):
+        '''(times, codes) arrays of every event of the setting in time order, options are numbered in codes as they are first seen'''
+
+        entries = [(offset, options[setting]) for offset, options in self.pattern if setting in options]
+
+        offsets = np.array([offset for offset, _ in entries])
+        pattern_codes = np.array([codes.setdefault(option, len(codes)) for _, option in entries])
+
+        iteration_starts = self.start + np.arange(self.count) * self.period
+        times = (iteration_starts[:, np.newaxis] + offsets).ravel()
+
+        #event i of the run is entry i % len(entries) of the pattern
+        return times, pattern_codes[np.arange(len(times)) % len(entries)]
+
+    def to_json(self):
+        return [self.start, self.period, self.count, [[offset, options] for offset, options in self.pattern]]
+
+    @classmethod
+    def from_json(cls, data):
+        start, period, count, pattern = data
+        return cls(start, period, count, [(offset, options) for offset, options in pattern])
+
 class TemporalDict:
+    '''Timeline events, as time -> {setting: option} plus Periodic runs of deterministic background loops.
+
+    Periodic runs are only expanded when states are generated, and then one setting at a time with numpy.
+    Where events land on the same time the one added last wins, like writes into the dict.'''
+
     def __init__(self, args):
         self.args = args
         self.data = defaultdict(dict)
+        self.periodic = []
         self._sorted_data = None
+        self._times = None
+        self._setting_index = None
+        self._plain_data = None
+        self._event_frames = None
         self.dirty = True
 
     def add_entry(self, setting, option, time):
@@ -15,56 +90,304 @@ class TemporalDict:
             self.data[time].update({setting: option})
             self.dirty = True
 
+    def add_periodic(self, start, period, count, pattern):
+        periodic = Periodic(start, period, count, pattern)
+
+        #events already at the same times are overwritten, later ones win as they are written after
+        for time, options in list(periodic.collisions(self.data.keys())):
+            entry = self.data[time]
+
+            for setting in options:
+                entry.pop(setting, None)
+
+            if len(entry) == 0:
+                del self.data[time]
+
+        self.periodic.append(periodic)
+        self.dirty = True
+
     @property
     def sorted_data(self):
 
         if self._sorted_data is not None and not self.dirty:
-            return self.sorted_data
+            return self._sorted_data
 
         self._sorted_data = sorted(self.data.items(), key=itemgetter(0))
+        self._times = [time for time, _ in self._sorted_data]
+        self._setting_index = None
+        self._plain_data = None
+        self._event_frames = None
+        self.dirty = False
 
         return self._sorted_data
 
+    @property
+    def times(self):
+        '''Sorted event times, parallel to sorted_data'''
+
+        self.sorted_data
+        return self._times
+
     def __len__(self):
-        return len(self.data)
-    
+        return len(self.data) + sum(periodic.event_count() for periodic in self.periodic)
+
     @property
     def min_time(self):
-        return self.sorted_data[0][0] 
+        times = [periodic.min_time for periodic in self.periodic]
+
+        if len(self.data) != 0:
+            times.append(self.sorted_data[0][0])
+
+        return min(times)
 
     @property
     def max_time(self):
-        return self.sorted_data[-1][0]
+        times = [periodic.max_time for periodic in self.periodic]
+
+        if len(self.data) != 0:
+            times.append(self.sorted_data[-1][0])
+
+        return max(times)
+
+    @property
+    def frame_time(self):
+        '''Script time in ms per frame, as an exact fraction so frame windows never depend on float rounding'''
+
+        #the speed as it was written, 1.1 rather than the nearest float to it
+        return Fraction(str(self.args.speed_multiplier)) * 1000 / self.args.fps
 
     def __getitem__(self, key):
         if not isinstance(key, slice):
             return self.data[key]
 
-        return list(item[1] for item in filter( (lambda x: key.start <= x[0] < key.stop), self.sorted_data)) ###This can be optimized to take advantaged of the sorted data
-    
-    def states_generator(self):
-        current_state = {}
+        sorted_data, times = self.sorted_data, self.times
+
+        start = bisect_left(times, key.start)
+        stop = bisect_left(times, key.stop, lo=start)
+
+        return [item[1] for item in sorted_data[start:stop]]
+
+    @property
+    def setting_index(self):
+        '''setting -> (times, options) of every event in data touching that setting, in time order'''
+
+        if self._setting_index is not None and not self.dirty:
+            return self._setting_index
+
+        setting_index = {}
+
+        for time, options in self.sorted_data:
+            for setting, option in options.items():
+                times, setting_options = setting_index.setdefault(setting, ([], []))
+                times.append(time)
+                setting_options.append(option)
+
+        self._setting_index = setting_index
+
+        return setting_index
+
+    def state_before(self, time, exclude=()):
+        '''Options in effect from events in data strictly before time, found with one bisect per setting'''
+
+        state = {}
+
+        for setting, (times, options) in self.setting_index.items():
+            if setting in exclude:
+                continue
+
+            index = bisect_left(times, time)
+
+            if index != 0:
+                state[setting] = options[index - 1]
 
-        frame_time = self.args.speed_multiplier / self.args.fps * 1000
-        
-        start, stop = self.min_time - frame_time / 2, self.min_time + frame_time / 2
+        return state
 
-        while start <= self.max_time:
+    def frame_stop(self, index):
+        '''End of the window of script time that frame index covers, windows are centred on multiples of frame_time.
 
-            for state in self[start:stop]:
-                current_state.update(state)
+        The end is exact, an event lying on it belongs to the next frame.'''
+        return Fraction(self.min_time) + (index + Fraction(1, 2)) * self.frame_time
 
-            state_obj = State(current_state)
+    def frame_at(self, time):
+        '''Index of the frame whose window contains the given script time in ms'''
+        return floor((Fraction(time) - Fraction(self.min_time)) / self.frame_time + Fraction(1, 2))
+
+    def frames_at(self, times):
+        '''frame_at of every time in a numpy array, in integer arithmetic when the times are whole ms and in floats otherwise'''
+
+        frame_time, min_time = self.frame_time, Fraction(self.min_time)
+        numerator, denominator = frame_time.numerator, frame_time.denominator
+
+        if len(times) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        #floor((time - min_time) / frame_time + 1/2) with both sides scaled by 2 * frame_time's numerator
+        if min_time.denominator == 1 and np.all(np.mod(times, 1) == 0) and float(np.abs(times).max() + abs(min_time) + 1) * 2 * denominator < 2**62:
+            offsets = times.astype(np.int64) - int(min_time)
+            return (offsets * (2 * denominator) + numerator) // (2 * numerator)
+
+        approximate = (times - float(min_time)) / float(frame_time) + 0.5
+        frames = np.floor(approximate).astype(np.int64)
+
+        #float rounding only matters for times right at a window's edge, those are mapped exactly
+        for index in np.flatnonzero(np.abs(approximate - np.rint(approximate)) < 1e-6).tolist():
+            frames[index] = self.frame_at(times[index].item())
+
+        return frames
+
+    @property
+    def event_frames(self):
+        '''Frame of each event time, parallel to times'''
+
+        times = self.times
+
+        if self._event_frames is None:
+            self._event_frames = self.frames_at(np.array(times)).tolist()
+
+        return self._event_frames
+
+    @property
+    def periodic_settings(self):
+        return set().union(*(periodic.settings for periodic in self.periodic))
+
+    @property
+    def plain_data(self):
+        '''sorted_data without the settings driven by periodic runs, which periodic_changes looks up instead'''
+
+        sorted_data = self.sorted_data
+
+        if self._plain_data is None:
+            periodic_settings = self.periodic_settings
+            self._plain_data = [(time, {setting: option for setting, option in options.items() if setting not in periodic_settings}) for time, options in sorted_data]
+
+        return self._plain_data
+
+    def periodic_changes(self, start, stop):
+        '''Settings driven by periodic runs -> option at frame start, and frame -> [(setting, option)] where they change after it.
+
+        Each setting's events from data and from every run touching it are merged as arrays of times and
+        option codes, mapped to their frames and looked up for all frames at once, Python only sees the frames where an option changes.'''
+
+        frames = np.arange(start, stop)
+        setting_index = self.setting_index
+
+        initial = {}
+        changes = defaultdict(list)
+
+        for setting in self.periodic_settings:
+            codes = {}
+            tracks = [periodic.track(setting, codes) for periodic in self.periodic if setting in periodic.settings]
+
+            #events in data come last, they only ever tie with runs added before them
+            if setting in setting_index:
+                times, options = setting_index[setting]
+                tracks.append((np.array(times), np.array([codes.setdefault(option, len(codes)) for option in options])))
+
+            options = list(codes)
+
+            if len(tracks) == 1:
+                times, event_codes = tracks[0]
+            else:
+                times = np.concatenate([times for times, _ in tracks])
+                event_codes = np.concatenate([event_codes for _, event_codes in tracks])
+
+                #stable sort, so of events on the same time the one from the latest track is looked up last
+                order = np.argsort(times, kind="stable")
+                times, event_codes = times[order], event_codes[order]
+
+            #the last event of each frame, events at the same frame keep their order from the stable sort
+            events = np.searchsorted(self.frames_at(times), frames, side="right") - 1
+            frame_codes = np.where(events >= 0, event_codes[events], -1)
+
+            if frame_codes[0] >= 0:
+                initial[setting] = options[frame_codes[0]]
+
+            changed = np.flatnonzero(frame_codes[1:] != frame_codes[:-1]) + 1
+
+            for frame, code in zip(changed.tolist(), frame_codes[changed].tolist()):
+                changes[start + frame].append((setting, options[code]))
+
+        return initial, changes
+
+    def states_generator(self, start=0, stop=None):
+        '''Sweeps the sorted events once alongside the frames, so N frames over M events cost O(N + M).
+
+        Every event is mapped to its frame exactly once, see frames_at, so events on a window's edge always go to the later frame.
+
+        Frames from start up to stop are yielded, the state at start is looked up directly instead of sweeping the frames before it.
+        Settings driven by periodic runs are looked up separately by periodic_changes.'''
+
+        stop = self.frame_count if stop is None else min(stop, self.frame_count)
+
+        if start >= stop:
+            return
+
+        sorted_data = self.sorted_data
+        event_frames = self.event_frames
+        event_count = len(sorted_data)
+
+        periodic_settings = self.periodic_settings
+
+        if len(periodic_settings) != 0:
+            initial, changes = self.periodic_changes(start, stop)
+            sorted_data = self.plain_data
+        else:
+            initial, changes = {}, {}
+
+        #the first frame takes every event up to its window's end, later frames only the events of their own window
+        current_state = self.state_before(self.frame_stop(start), exclude=periodic_settings)
+        current_state.update(initial)
+        state_obj = State(current_state)
+        event_index = bisect_right(event_frames, start)
+
+        yield state_obj
+
+        for index in range(start + 1, stop):
+            changed = False
+
+            while event_index < event_count and event_frames[event_index] <= index:
+                current_state.update(sorted_data[event_index][1])
+                event_index += 1
+                changed = True
+
+            if index in changes:
+                current_state.update(changes[index])
+                changed = True
+
+            #frames without events hold the previous state, no need to build it again
+            if changed:
+                state_obj = State(current_state)
 
             yield state_obj
 
-            start, stop = stop, stop + frame_time
+    @property
+    def frame_count(self):
+        '''Number of frames in the timeline, the last one is the frame whose window contains the last event, see frame_at'''
+
+        return self.frame_at(self.max_time) + 1
+
+    def to_events(self):
+        '''[time, {setting: option}] pairs in time order, the serializable form of the timeline along with to_periodic'''
+        return [[time, options] for time, options in self.sorted_data]
+
+    def to_periodic(self):
+        return [periodic.to_json() for periodic in self.periodic]
+
+    @classmethod
+    def from_events(cls, args, events, periodic=()):
+        temporal_dict = cls(args)
+
+        for time, options in events:
+            temporal_dict.data[time].update(options)
+
+        temporal_dict.periodic = [Periodic.from_json(data) for data in periodic]
+
+        return temporal_dict
 
     @property
     def states(self):
         return list(self.states_generator())
 
     def print(self):
-        for index, state in enumerate(self.states):
+        for index, state in enumerate(self.states_generator()):
             print(f"Frame {index}: {state!r}")
-
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+from math import ceil
+from tempfile import TemporaryFile
+import json
+import numpy as np
+
+import cv2
+
+class TextureAtlas:
+    '''Tiled texture that frames are written straight into.
+
+    One array is preallocated per output size, optionally memory mapped for huge sheets. Each frame is
+    copied, or resized when texture dimensions are given, directly into its tile of every output, so
+    the full resolution atlas never has to exist when only smaller textures are wanted.'''
+
+    def __init__(self, args, frame_count, output_path=None):
+        self.args = args
+        self.output_path = output_path if output_path is not None else args.output_path
+        self.frame_count = frame_count
+        self.columns, self.rows = self.get_layout(frame_count, args.texture_layout)
+
+        self.targets = None
+        self.temp_files = []
+
+    @staticmethod
+    def get_layout(n, layout):
+        '''(columns, rows) of the tile grid'''
+
+        if layout == "square":
+            width = ceil(n ** 0.5)
+            height = ceil(n / width)
+        elif layout == "horizontal":
+            width = n
+            height = 1
+        elif layout == "vertical":
+            width = 1
+            height = n
+
+        return width, height
+
+    def allocate(self, tile_shape):
+        tile_height, tile_width, channels = tile_shape
+
+        original_path = self.output_path
+
+        #Defaults to saving texture in full resolution
+        if self.args.texture_dimensions is None:
+            sizes = [(original_path, self.columns * tile_width, self.rows * tile_height)]
+
+        #Otherwise we pull out path information to give each produced texture a proper filename
+        else:
+            stem = str(original_path.stem)
+            suffix = str(original_path.suffix)
+
+            sizes = [(original_path.with_name(f"{stem}_{width}x{height}{suffix}"), width, height) for width, height in self.args.texture_dimensions]
+
+        self.sizes = sizes
+        self.targets = [(path, self.new_array((height, width, channels))) for path, width, height in sizes]
+
+    def new_array(self, shape):
+        if not self.args.texture_memmap:
+            return np.zeros(shape, np.uint8)
+
+        temp_file = TemporaryFile(dir=self.output_path.parent)
+        self.temp_files.append(temp_file)
+
+        #a fresh memory map is zero filled, so padding tiles stay blank
+        return np.memmap(temp_file, dtype=np.uint8, mode="w+", shape=shape)
+
+    def tile_box(self, index, width, height):
+        '''(left, top, right, bottom) of a tile in a texture of the given size, tiles get the rounded share of the size'''
+
+        row, column = divmod(index, self.columns)
+
+        left, right = round(column * width / self.columns), round((column + 1) * width / self.columns)
+        top, bottom = round(row * height / self.rows), round((row + 1) * height / self.rows)
+
+        return left, top, right, bottom
+
+    def add(self, index, frame):
+        if self.targets is None:
+            self.allocate(frame.shape)
+
+        for _, texture in self.targets:
+            texture_height, texture_width, _ = texture.shape
+            left, top, right, bottom = self.tile_box(index, texture_width, texture_height)
+
+            tile = texture[top:bottom, left:right]
+
+            if tile.shape == frame.shape:
+                tile[...] = frame
+            elif tile.size != 0:
+                tile[...] = cv2.resize(frame, (right - left, bottom - top), interpolation=cv2.INTER_AREA)#TODO: make interpolation a CL argument
+
+    def save(self):
+        for path, texture in self.targets:
+
+            if self.args.verbose:
+                height, width, _ = texture.shape
+                print(f"Saving {width}x{height} texture")
+
+            cv2.imwrite(str(path), texture)
+
+        self.close()
+
+    @property
+    def sidecar_path(self):
+        return self.output_path.with_suffix(".json")
+
+    @property
+    def base_path(self):
+        original_path = self.output_path
+        return original_path.with_name(f"{original_path.stem}_base{original_path.suffix}")
+
+    def save_base(self, frame):
+        '''Saves a full frame holding the pixels outside the trimmed region, which never change'''
+
+        if self.args.verbose:
+            print(f"Saving static base image to {self.base_path}")
+
+        cv2.imwrite(str(self.base_path), frame)
+
+    def save_sidecar(self, runs, region=None):
+        '''Writes the frame index next to the texture: which tile each stretch of timeline frames shows and for how long.
+        Trimmed textures also record where their tiles go on top of the base image.'''
+
+        frame_duration = 1000 / self.args.fps
+
+        frames = []
+        frame_index = 0
+
+        for tile, count in runs:
+            frames.append({"frame": frame_index, "tile": tile, "duration": count * frame_duration})
+            frame_index += count
+
+        sidecar = {
+            "fps": self.args.fps,
+            "frame_count": frame_index,
+            "tile_count": self.frame_count,
+            "columns": self.columns,
+            "rows": self.rows,
+            "textures": [{"path": path.name, "width": width, "height": height} for path, width, height in self.sizes],
+            "frames": frames,
+        }
+
+        if region is not None:
+            left, top, right, bottom = region
+
+            sidecar["base"] = self.base_path.name
+            sidecar["region"] = {"x": left, "y": top, "width": right - left, "height": bottom - top}
+
+        if self.args.verbose:
+            print(f"Saving frame index to {self.sidecar_path}")
+
+        with open(self.sidecar_path, "w") as file:
+            json.dump(sidecar, file, indent=4)
+
+    def close(self):
+        self.targets = None
+
+        for temp_file in self.temp_files:
+            temp_file.close()
+
+        self.temp_files = []
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+
+from pathlib import Path
+from types import ModuleType
+import ast
+import hashlib
+import json
+import os
+import sys
+
+from TemporalDict import TemporalDict
+
+class TimelineCache:
+    '''Compiled timelines stored as JSON next to the image cache.
+
+    A timeline is keyed by a hash of the script's path and source, the local modules it imports, the
+    API it runs against and the args visible to it. Local modules found imported once the script ran
+    are recorded with their hashes as well and checked again before the timeline is reused, which
+    also covers imports the key cannot see. Scripts using randomness, the time or the environment
+    are never cached, see volatile_modules.
+    The files only hold the timeline events and periodic runs, so one can be rendered anywhere with --timeline.'''
+
+    version = 2
+
+    #version 1 files are version 2 files without periodic runs
+    readable_versions = (1, 2)
+
+    subdirectory = "timelines"
+
+    #modules whose behaviour is baked into every compiled timeline
+    runtime_modules = ("API.py", "tools.py", "TemporalDict.py", "ScriptParser.py", "TimelineCache.py")
+
+    #scripts using these can compile to a different timeline on every run, so their timelines are never reused
+    volatile_modules = ("random", "time", "datetime", "os", "secrets", "uuid", "numpy.random")
+
+    def __init__(self, args):
+        self.args = args
+        self.directory = args.directory / self.subdirectory
+
+        #local modules of the last timeline loaded
+        self.dependencies = []
+
+    @staticmethod
+    def hash_file(path):
+        return hashlib.sha1(Path(path).read_bytes()).hexdigest()
+
+    @staticmethod
+    def imported_files(script_path):
+        '''Source files next to the script that it imports, directly or through each other, found without running it'''
+
+        script_directory = script_path.resolve().parent
+
+        files = []
+        pending = [script_path.resolve()]
+
+        while len(pending) != 0:
+            path = pending.pop()
+
+            try:
+                tree = ast.parse(path.read_bytes())
+            except (SyntaxError, ValueError):
+                #running the script reports the error
+                continue
+
+            for node in ast.walk(tree):
+                if isinstance(node, ast.Import):
+                    names = [alias.name for alias in node.names]
+                elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module is not None:
+                    names = [node.module]
+                else:
+                    continue
+
+                for name in names:
+                    top_level = name.partition(".")[0]
+
+                    for candidate in (script_directory / f"{top_level}.py", script_directory / top_level / "__init__.py"):
+                        if candidate.is_file() and candidate not in files:
+                            files.append(candidate)
+                            pending.append(candidate)
+
+        return sorted(files)
+
+    def key(self, script_path):
+        digest = hashlib.sha1()
+
+        #identical scripts in different directories can import different local modules
+        digest.update(str(script_path.resolve()).encode())
+        digest.update(script_path.read_bytes())
+
+        for path in self.imported_files(script_path):
+            digest.update(f"{path.name}:{self.hash_file(path)}".encode())
+
+        runtime_directory = Path(__file__).resolve().parent
+
+        for name in self.runtime_modules:
+            digest.update(self.hash_file(runtime_directory / name).encode())
+
+        #fps and speed do not change the event times, but scripts can see them through the api
+        digest.update(f"{self.args.fps}:{self.args.speed_multiplier}".encode())
+
+        return digest.hexdigest()
+
+    def path(self, script_path):
+        return self.directory / f"{self.key(script_path)}.json"
+
+    @staticmethod
+    def script_modules(script_path):
+        '''path -> module of the script and the imported modules living next to it'''
+
+        script_directory = script_path.resolve().parent
+
+        modules = {}
+
+        for module in list(sys.modules.values()):
+            module_file = getattr(module, "__file__", None)
+
+            if module_file is None:
+                continue
+
+            module_path = Path(module_file).resolve()
+
+            if module_path.suffix == ".py" and module_path.parent == script_directory:
+                modules[module_path] = module
+
+        return modules
+
+    @classmethod
+    def local_modules(cls, script_path):
+        '''Source files of imported modules living next to the script, other than the script itself'''
+
+        script_file = script_path.resolve()
+
+        return sorted(path for path in cls.script_modules(script_path) if path != script_file)
+
+    @classmethod
+    def is_volatile_name(cls, name):
+        return any(name == module or name.startswith(f"{module}.") for module in cls.volatile_modules)
+
+    @classmethod
+    def uses_volatile_modules(cls, script_path):
+        '''Whether the script or its local modules refer to a volatile module, or to anything imported from one'''
+
+        runtime_directory = Path(__file__).resolve().parent
+        script_file = script_path.resolve()
+
+        for path, module in cls.script_modules(script_path).items():
+            #scripts next to AutoAnim share their directory with modules that are not theirs
+            if path.parent == runtime_directory and path != script_file:
+                continue
+
+            for value in list(vars(module).values()):
+                if isinstance(value, ModuleType):
+                    name = value.__name__
+                else:
+                    name = getattr(value, "__module__", None)
+
+                if isinstance(name, str) and cls.is_volatile_name(name):
+                    return True
+
+        return False
+
+    def load(self, script_path):
+        '''The compiled timeline of the script, or None when it has not been compiled or any dependency changed'''
+
+        path = self.path(script_path)
+
+        try:
+            compiled = self.read(path)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        for dependency, digest in compiled["dependencies"].items():
+            try:
+                if self.hash_file(dependency) != digest:
+                    return None
+            except FileNotFoundError:
+                return None
+
+        self.dependencies = [Path(dependency) for dependency in compiled["dependencies"]]
+
+        if self.args.verbose:
+            print(f"Loaded compiled timeline {path}")
+
+        return self.temporal_dict(compiled)
+
+    def temporal_dict(self, compiled):
+        return TemporalDict.from_events(self.args, compiled["events"], compiled.get("periodic", []))
+
+    def read(self, path):
+        with open(path) as file:
+            compiled = json.load(file)
+
+        if compiled.get("version") not in self.readable_versions:
+            raise ValueError(f"Unsupported timeline version in {path}")
+
+        return compiled
+
+    def load_file(self, path):
+        '''Loads a compiled timeline without checking it against any script'''
+
+        return self.temporal_dict(self.read(path))
+
+    def save(self, script_path, temporal_dict):
+        path = self.path(script_path)
+
+        compiled = {
+            "version": self.version,
+            "script": script_path.name,
+            "dependencies": {str(dependency): self.hash_file(dependency) for dependency in self.local_modules(script_path)},
+            "events": temporal_dict.to_events(),
+            "periodic": temporal_dict.to_periodic(),
+        }
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        #write to the side and rename so a crash never leaves a truncated timeline
+        temp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+
+        with open(temp_path, "w") as file:
+            json.dump(compiled, file, separators=(",", ":"))
+
+        os.replace(temp_path, path)
+
+        if self.args.verbose:
+            print(f"Saved compiled timeline {path}")
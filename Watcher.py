@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+from time import sleep, perf_counter
+import sys
+import traceback
+
+class Watcher:
+    '''Keeps an animator resident and re-renders whenever the script or a module it imports changes.
+
+    The psd, its layer rasters, the frame cache and the render pool all survive between runs, so an edit
+    only pays for running the script and rendering states that have not been seen before.'''
+
+    #seconds between checks for changed files
+    poll_interval = 0.2
+
+    def __init__(self, args, animator):
+        self.args = args
+        self.animator = animator
+        self.animator.image_source.resident = True
+
+        #bytecode caches only store source mtimes to the second, an edit right after a render could be served stale
+        sys.dont_write_bytecode = True
+
+    def snapshot(self):
+        '''mtime of every watched file, None for files that are missing'''
+
+        snapshot = {}
+
+        for path in self.animator.script_parser.dependencies:
+            try:
+                snapshot[path] = path.stat().st_mtime_ns
+            except FileNotFoundError:
+                snapshot[path] = None
+
+        return snapshot
+
+    def render(self):
+        start = perf_counter()
+
+        try:
+            self.animator.parse_script()
+
+            if not self.args.no_output:
+                self.animator.animate()
+        except Exception:
+            #a broken edit should not end the session, report it and wait for the next one
+            traceback.print_exc()
+            return
+
+        print(f"Rendered {', '.join(str(path) for _, path in self.args.outputs)} in {perf_counter() - start:.2f}s")
+
+    def run(self):
+        snapshot = self.snapshot()
+
+        print(f"Watching {len(snapshot)} file(s) for changes, press CTRL+C to stop")
+
+        try:
+            while True:
+                sleep(self.poll_interval)
+
+                current = self.snapshot()
+
+                if current == snapshot:
+                    continue
+
+                if self.args.verbose:
+                    changed = [path.name for path in current.keys() | snapshot.keys() if current.get(path) != snapshot.get(path)]
+                    print(f"Changed: {', '.join(changed)}")
+
+                self.render()
+
+                #dependencies are looked up again as the edit may have changed imports, files edited during the render stay marked as changed
+                snapshot = {path: current.get(path, mtime) for path, mtime in self.snapshot().items()}
+
+        except KeyboardInterrupt:
+            print("Stopped watching")
+
+        finally:
+            self.animator.image_source.close()
@@ -52,7 +52,7 @@ def addExclusiveArgs(parser, argList):
 
     handleArgList(group, argList)
 
-def parseArgs(parserSetup):
+def parseArgs(parserSetup, argv=None):
     if "args" not in parserSetup:
         raise KeyError("parseArgs: parserSetup must contain 'args'")
     
@@ -67,4 +67,4 @@ def parseArgs(parserSetup):
 
     handleArgList(parser, argList)
 
-    return parser.parse_args();
+    return parser.parse_args(argv);
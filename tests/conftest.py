@@ -0,0 +1,53 @@
+from pathlib import Path
+import sys
+
+import pytest
+
+#the modules live at the top of the repository rather than in a package
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from Benchmark import build_psd
+
+@pytest.fixture
+def psd_path(tmp_path):
+    '''A small synthetic scene with groups group0 and group1 of options "0" to "2"'''
+
+    path = tmp_path / "scene.psd"
+    build_psd(path, 48, 32, groups=2, options=3)
+
+    return path
+
+@pytest.fixture
+def image_source(psd_path, tmp_path):
+    '''Builds an ImageSource for the psd_path scene with its image cache in tmp_path, taking extra command line args'''
+
+    from AutoAnim import getArgs
+    from ImageSource import ImageSource
+
+    def image_source(*extra):
+        args = getArgs(["-p", str(psd_path), "-s", str(tmp_path / "scene.py"), "-i", str(tmp_path / "cache"), *extra])
+        args.directory.mkdir(exist_ok=True)
+
+        return ImageSource(args)
+
+    return image_source
+
+@pytest.fixture
+def parse(tmp_path):
+    '''Compiles a script's source into its TemporalDict, without the timeline cache'''
+
+    from AutoAnim import getArgs
+    from ScriptParser import ScriptParser
+
+    def parse(source, name="scene", extra=()):
+        script_path = tmp_path / f"{name}.py"
+        script_path.write_text(source)
+
+        args = getArgs(["-s", str(script_path), "-i", str(tmp_path / "cache"), "--no-timeline-cache", *extra])
+
+        return ScriptParser(args).parse_script()
+
+    return parse
+
+def frame_states(temporal_dict):
+    return [state.canonical_name for state in temporal_dict.states_generator()]
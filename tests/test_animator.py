@@ -0,0 +1,33 @@
+import pytest
+
+from AutoAnim import getArgs, main
+
+SCRIPT = '''
+def main():
+    settings = {"group0": ["0", "1", "2"], "group1": ["0", "1", "2"]}
+
+    at = AnimTools(settings).init_with_first()
+    at.sequence("pulse").pulse("group0", 100).loop_background()
+
+    wait(2000)
+    set_state("group1", "{option}")
+    wait(100)
+'''
+
+def render(tmp_path, psd_path, option):
+    script_path = tmp_path / "scene.py"
+    script_path.write_text(SCRIPT.replace("{option}", option))
+
+    main(getArgs(["-p", str(psd_path), "-s", str(script_path), "-i", str(tmp_path / "cache"), "-o", str(tmp_path / "out.avi")]))
+
+def test_invalid_state_fails_before_rendering(tmp_path, psd_path):
+    with pytest.raises(ValueError, match="group1:9"):
+        render(tmp_path, psd_path, "9")
+
+    assert list((tmp_path / "cache").glob("*.png")) == []
+
+def test_valid_timeline_renders(tmp_path, psd_path):
+    render(tmp_path, psd_path, "2")
+
+    assert len(list((tmp_path / "cache").glob("*.png"))) != 0
+    assert (tmp_path / "out.avi").stat().st_size != 0
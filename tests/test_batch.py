@@ -0,0 +1,73 @@
+from pathlib import Path
+import json
+import subprocess
+import sys
+
+from AutoAnim import getArgs, main
+
+AUTOANIM = Path(__file__).resolve().parents[1] / "AutoAnim.py"
+
+SCRIPT = '''
+def main():
+    settings = {{"group0": ["0", "1", "2"], "group1": ["0", "1", "2"]}}
+
+    at = AnimTools(settings).init_with_first()
+    at.sequence("pulse").pulse("group0", 100).loop_background()
+
+    wait({duration})
+'''
+
+def write_job(directory, duration):
+    directory.mkdir()
+    (directory / "anim.py").write_text(SCRIPT.format(duration=duration))
+
+def frame_count(directory):
+    return len(list(directory.glob("*.png")))
+
+def write_manifest(tmp_path):
+    write_job(tmp_path / "j1", 2000)
+    write_job(tmp_path / "j2", 1000)
+
+    manifest = tmp_path / "jobs.json"
+    manifest.write_text(json.dumps({"jobs": [
+        {"script-path": "j1/anim.py", "output": "frames:out/j1"},
+        {"script-path": "j2/anim.py", "output": "frames:out/j2"},
+    ]}))
+
+    return manifest
+
+def solo_frame_counts(tmp_path, psd_path):
+    '''Frames of each job rendered on its own in a new process, with a fresh image and timeline cache'''
+
+    counts = {}
+
+    for job in ("j1", "j2"):
+        output = tmp_path / "solo" / job
+        subprocess.run([sys.executable, str(AUTOANIM), "-p", str(psd_path), "-i", str(tmp_path / f"cache_{job}"), "-s", str(tmp_path / job / "anim.py"), "--output", f"frames:{output}"], check=True)
+        counts[job] = frame_count(output)
+
+    return counts
+
+def batch_frame_counts(tmp_path, psd_path, manifest):
+    for frame in (tmp_path / "out").glob("*/*.png"):
+        frame.unlink()
+
+    main(getArgs(["-p", str(psd_path), "-i", str(tmp_path / "cache"), "--batch", str(manifest)]))
+
+    return {job: frame_count(tmp_path / "out" / job) for job in ("j1", "j2")}
+
+def test_jobs_with_same_named_scripts_stay_separate(tmp_path, psd_path):
+    manifest = write_manifest(tmp_path)
+
+    counts = batch_frame_counts(tmp_path, psd_path, manifest)
+
+    assert counts == solo_frame_counts(tmp_path, psd_path)
+    assert counts["j1"] > counts["j2"]
+
+def test_batch_timelines_are_cached_under_their_own_script(tmp_path, psd_path):
+    manifest = write_manifest(tmp_path)
+
+    batch_frame_counts(tmp_path, psd_path, manifest)
+
+    #the second run reads both timelines back from the timeline cache
+    assert batch_frame_counts(tmp_path, psd_path, manifest) == solo_frame_counts(tmp_path, psd_path)
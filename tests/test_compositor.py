@@ -0,0 +1,55 @@
+from itertools import product
+
+import numpy as np
+import pytest
+from psd_tools import compose
+
+from State import State
+
+def sequence():
+    '''States changing one group or both at a time, revisiting earlier options'''
+
+    options = ["0", "1", "2"]
+    states = [State({"group0": first, "group1": second}) for first, second in product(options, options)]
+
+    return states + states[::-1] + [State({"group0": "1"}), State({"group1": "2"}), states[0]]
+
+def reference(source, state):
+    '''The state composed by psd_tools, the way frames were rendered before the compositor'''
+
+    wanted_layers = set(source.compositor.chosen_layers(state))
+    pil_image = compose(list(source.psd.descendants()), layer_filter=wanted_layers.__contains__, bbox=source.psd.viewbox)
+
+    return np.asarray(pil_image.convert("RGBA")).astype(int)
+
+def test_matches_psd_tools(image_source):
+    source = image_source()
+
+    for state in sequence():
+        pixels = source.compositor.compose_array(state).astype(int)
+
+        assert np.abs(pixels - reference(source, state)).max() <= 1, state
+
+@pytest.mark.parametrize("snapshot_mb", ["0", "1"])
+def test_snapshots_do_not_change_output(image_source, snapshot_mb):
+    '''Frames are the same whether or not they were composited on top of a snapshot, and with any history'''
+
+    source = image_source("--snapshot-mb", snapshot_mb)
+
+    for state in sequence():
+        fresh = image_source().compositor.compose_array(state)
+
+        assert np.array_equal(source.compositor.compose_array(state), fresh), state
+
+def test_snapshot_budget(image_source):
+    source = image_source()
+    compositor = source.compositor
+
+    #room for a single float RGBA snapshot of the 48x32 canvas
+    compositor.snapshot_budget = 48 * 32 * 4 * 4
+
+    for state in sequence():
+        compositor.compose_array(state)
+
+    assert compositor.snapshot_capacity == 1
+    assert sum(snapshot is not None for snapshot in compositor.snapshots) == 1
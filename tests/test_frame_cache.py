@@ -0,0 +1,41 @@
+import numpy as np
+
+from FrameCache import FrameCache
+from State import State
+
+def frame(value, rows=4):
+    return np.full((rows, 8, 3), value, np.uint8)
+
+def test_overfilling_evicts_least_recently_used():
+    first, second, third, fourth = (State({"group0": option}) for option in "0123")
+
+    #room for three 96 byte frames
+    cache = FrameCache(3 * frame(0).nbytes)
+
+    cache.put(first, frame(0))
+    cache.put(second, frame(1))
+    cache.put(third, frame(2))
+
+    #reading first makes second the least recently used
+    assert cache.get(first) is not None
+
+    cache.put(fourth, frame(3))
+
+    assert second not in cache
+    assert [first, third, fourth] == [state for state in (first, second, third, fourth) if state in cache]
+    assert (cache.size, cache.evictions) == (3 * frame(0).nbytes, 1)
+
+    #a larger frame takes the place of the two least recently used ones
+    cache.put(second, frame(1, rows=8))
+
+    assert first not in cache and third not in cache
+    assert (len(cache), cache.size, cache.evictions) == (2, frame(0).nbytes + frame(0, rows=8).nbytes, 3)
+    assert cache.size == sum(cached.nbytes for cached in cache.frames.values())
+
+def test_frames_larger_than_the_budget_are_not_cached():
+    state = State({"group0": "0"})
+    cache = FrameCache(frame(0).nbytes)
+
+    cache.put(state, frame(0, rows=5))
+
+    assert state not in cache and cache.size == 0
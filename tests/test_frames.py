@@ -0,0 +1,59 @@
+from argparse import Namespace
+from fractions import Fraction
+from math import floor
+
+import numpy as np
+import pytest
+
+from TemporalDict import TemporalDict
+
+#at 30fps a frame lasts 100/3 ms, frame i covers [(i - 0.5) * 100/3, (i + 0.5) * 100/3)
+EDGE_SCRIPT = '''
+def main():
+    settings = {"a": ["0", "1", "2", "3"], "b": ["0", "1", "2"]}
+
+    at = AnimTools(settings).init_with_first()
+    at.sequence("p").pulse("b", 50).loop_background()
+
+    wait(150)
+    set_state("a", "1")
+    wait(299)
+    set_state("a", "2")
+    wait(1)
+    set_state("a", "3")
+    wait(550)
+'''
+
+def timeline(fps, speed_multiplier):
+    '''A timeline starting at 0ms'''
+
+    temporal_dict = TemporalDict(Namespace(fps=fps, speed_multiplier=speed_multiplier))
+    temporal_dict.add_entry("a", "0", 0)
+
+    return temporal_dict
+
+def exact_frame(time, fps=30, speed_multiplier=1.0):
+    return floor(Fraction(time) * fps / (1000 * Fraction(str(speed_multiplier))) + Fraction(1, 2))
+
+def test_events_on_a_window_edge_go_to_the_later_frame(parse):
+    states = [dict(state) for state in parse(EDGE_SCRIPT, extra=("--fps", "30")).states_generator()]
+
+    #150ms is the end of frame 4's window, 449ms lies in frame 13 and 450ms is the end of its window
+    assert [state["a"] for state in states[3:7]] == ["0", "0", "1", "1"]
+    assert [state["a"] for state in states[12:16]] == ["1", "2", "3", "3"]
+
+    #the pulse's events every 50ms land on the edges starting frames 2, 5 and 8
+    assert [state["b"] for state in states[:9]] == ["0", "0", "1", "2", "2", "1", "0", "0", "1"]
+
+@pytest.mark.parametrize("fps, speed_multiplier", [(30, 1.0), (24, 1.0), (60, 1.1), (25, 0.5)])
+def test_frames_are_exact(fps, speed_multiplier):
+    temporal_dict = timeline(fps, speed_multiplier)
+
+    whole = np.arange(0, 5000)
+    fractional = np.arange(0, 5000) * (100 / 3)
+
+    for times in (whole, fractional):
+        expected = [exact_frame(time, fps, speed_multiplier) for time in times.tolist()]
+
+        assert temporal_dict.frames_at(times).tolist() == expected
+        assert [temporal_dict.frame_at(time) for time in times.tolist()] == expected
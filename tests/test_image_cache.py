@@ -0,0 +1,115 @@
+import numpy as np
+import pytest
+
+from Benchmark import build_psd
+from State import State
+
+STATES = [State({"group0": "0", "group1": "1"}), State({"group0": "2", "group1": "0"})]
+
+def store(source, states):
+    '''Renders and stores the states, returning their RGBA pixels'''
+
+    renders = {state: source.compositor.compose_array(state) for state in states}
+
+    for state, pixels in renders.items():
+        source.cache.add(state)
+        source.cache.write(state, pixels)
+
+    source.cache.save_manifest()
+
+    return renders
+
+@pytest.mark.parametrize("cache_format", ["png", "pack"])
+def test_round_trip(image_source, cache_format):
+    renders = store(image_source("--cache-format", cache_format), STATES)
+
+    #a new run reads the frames back through the manifest
+    cache = image_source().cache
+
+    for state, pixels in renders.items():
+        assert state in cache
+        assert np.array_equal(cache.read(state), pixels[..., 2::-1])
+
+def test_formats_share_one_cache(image_source):
+    first, second = STATES
+
+    renders = store(image_source("--cache-format", "png"), [first])
+    renders.update(store(image_source("--cache-format", "pack"), [second]))
+
+    cache = image_source().cache
+
+    for state, pixels in renders.items():
+        assert np.array_equal(cache.read(state), pixels[..., 2::-1])
+
+def test_editing_the_psd_invalidates(image_source, psd_path):
+    store(image_source(), STATES)
+
+    build_psd(psd_path, 48, 32, groups=2, options=3, seed=1)
+
+    cache = image_source().cache
+
+    assert all(state not in cache for state in STATES)
+    assert list(cache.directory.glob("*.png")) == []
+
+def test_only_lookups_are_counted(image_source):
+    store(image_source(), STATES[:1])
+
+    cache = image_source().cache
+
+    assert STATES[0] in cache and STATES[1] not in cache
+    assert (cache.hits, cache.misses) == (0, 0)
+
+    assert cache.lookup(STATES[0]) and not cache.lookup(STATES[1])
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_concurrent_runs_keep_each_others_entries(image_source):
+    '''Two runs on one cache directory that both loaded the manifest before either saved'''
+
+    first, second = image_source(), image_source()
+
+    #the image cache is opened lazily, open both before either saves
+    first.cache, second.cache
+
+    renders = store(first, STATES[:1])
+    renders.update(store(second, STATES[1:]))
+
+    cache = image_source().cache
+
+    for state, pixels in renders.items():
+        assert np.array_equal(cache.read(state), pixels[..., 2::-1])
+
+def test_concurrent_runs_get_distinct_pack_slots(image_source):
+    first, second = image_source("--cache-format", "pack"), image_source("--cache-format", "pack")
+    first.cache, second.cache
+
+    renders = store(first, STATES[:1])
+    renders.update(store(second, STATES[1:]))
+
+    cache = image_source().cache
+
+    assert cache.entries[cache.key(STATES[0])]["slot"] != cache.entries[cache.key(STATES[1])]["slot"]
+
+    for state, pixels in renders.items():
+        assert np.array_equal(cache.read(state), pixels[..., 2::-1])
+
+def test_failed_png_write_leaves_no_temp_file(image_source, monkeypatch):
+    from PIL import Image
+
+    source = image_source()
+    state = STATES[0]
+    pixels = source.compositor.compose_array(state)
+
+    def save(image, path, format=None):
+        #fail part way, after the file was created
+        path.write_bytes(b"\x89PNG")
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(Image.Image, "save", save)
+
+    source.cache.add(state)
+
+    with pytest.raises(OSError, match="No space left"):
+        source.cache.write(state, pixels)
+
+    assert [path.name for path in source.cache.directory.iterdir() if path.name.endswith(".tmp")] == []
+    assert not source.cache.path(state).exists()
@@ -0,0 +1,31 @@
+import cv2
+import numpy as np
+import pytest
+
+SCRIPT = '''
+def main():
+    settings = {"group0": ["0", "1", "2"], "group1": ["0", "1", "2"]}
+
+    at = AnimTools(settings).init_with_first()
+    at.sequence("pulse").pulse("group0", 40).loop_background()
+    at.sequence("blink").set("group1", "1").wait(70).set("group1", "0").wait(90).loop_background()
+
+    wait(1000)
+'''
+
+@pytest.mark.parametrize("extra", [(), ("--frame-cache-mb", "0"), ("--frame-cache-mb", "0", "--dont-store")])
+def test_stream_follows_timeline_order(image_source, parse, extra):
+    '''States coming up again while their first render is still pending are streamed in timeline order'''
+
+    states = list(parse(SCRIPT).states_generator())
+
+    assert len(set(states)) < len(states)
+
+    source = image_source(*extra)
+    frames = list(source.stream_frames(states))
+
+    assert len(frames) == len(states)
+
+    for index, (state, frame) in enumerate(zip(states, frames)):
+        expected = cv2.cvtColor(source.compositor.compose_array(state), cv2.COLOR_RGBA2BGR)
+        assert np.array_equal(frame, expected), index
@@ -0,0 +1,114 @@
+import pytest
+
+import API
+from conftest import frame_states
+
+SCRIPTS = {
+    "sequences": '''
+def main():
+    settings = {"a": ["0", "1", "2", "3"], "b": ["0", "1", "2"], "c": ["x", "y"], "d": ["0", "1", "2", "3", "4"]}
+    at = AnimTools(settings).init_with_first()
+    at.sequence("pa").pulse("a", 70)
+    at.sequence("cb").cycle("b", 130, down_time=50)
+    at.sequence("tc").transition("c", 0, 1, 90).transition("c", 1, 0, 40)
+    at.sequence("fd").full_transition("d", 33)
+    at.sequence("rd").reverse_transition("d", 45)
+    at.sequence("pa").loop_background()
+    wait(300)
+    at.sequence("cb").loop_background()
+    at.sequence("tc").loop_background(num=5)
+    wait(2000)
+    at.stop_and_wait_for("cb")
+    at.sequence("fd").loop_background()
+    wait(1000)
+    at.sequence("fd").replace("rd")
+    wait(5000)
+    at.replace_sequences({"pa": "cb"})
+    wait(3000)
+''',
+    "aliases_and_pre_actions": '''
+def main():
+    settings = {"a": ["0", "1", "2", "3"], "b": ["0", "1", "2", "3"], "c": ["x", "y", "z"], "d": ["p", "q"]}
+    at = AnimTools(settings).init_with_first().alias_all("a", "b")
+    at.sequence("inner").cycle("c", 40).wait(25)
+    at.sequence("outer").pulse("a", 30, hold_time=10, down_time=20).set("d", "q").wait(35).set("d", 1).run_sequence("inner")
+    at.sequence("outer").add_pre_action(lambda: set_state("d", "p"))
+    at.sequence("outer").loop_background()
+    wait(1000)
+    set_state("a", "2")
+    at.sequence("tr").transition("c", "x", "z", 45)
+    at.sequence("tr").loop_background(num=7)
+    wait(777)
+    at.sequence("outer").stop()
+    set_state("c", "y")
+    at.pulse("b", 15).loop_background()
+    wait(2000)
+''',
+    "ties_on_one_setting": '''
+def main():
+    settings = {"a": ["0", "1", "2", "3"], "b": ["0", "1", "2", "3"]}
+    at = AnimTools(settings).init_with_first()
+    at.sequence("p").pulse("a", 50)
+    at.sequence("q").cycle("a", 50)
+    at.sequence("r").cycle("a", 25).set("b", 2).wait(50)
+    at.sequence("s").transition("a", 3, 0, 50).set("b", "1")
+    for name in "pqrs":
+        at.sequence(name).loop_background()
+    wait(700)
+    at.stop_and_wait_for("q", "p")
+    set_state("a", "3")
+    at.sequence("p").loop_background()
+    wait(1300)
+    at.sequence("r").stop()
+    at.sequence("s").stop(target=2500)
+    wait(1000)
+''',
+    "mixed_with_plain_loops": '''
+def main():
+    settings = {"a": ["0", "1", "2", "3"], "b": ["0", "1", "2", "3"]}
+    at = AnimTools(settings).init_with_first()
+    at.sequence("p").pulse("a", 50).add_action(lambda: set_state("b", "3"))
+    at.sequence("q").cycle("a", 50).wait(10)
+    at.sequence("r").cycle("b", 20)
+    for name in "pqr":
+        at.sequence(name).loop_background()
+    wait(1000)
+    at.sequence("q").stop()
+    at.sequence("r").stop(target=600)
+    wait(800)
+''',
+}
+
+@pytest.mark.parametrize("name", SCRIPTS)
+def test_periodic_runs_match_running_every_iteration(parse, name, monkeypatch):
+    periodic = parse(SCRIPTS[name], f"{name}_periodic")
+
+    assert len(periodic.periodic) != 0
+
+    #deterministic loops run one iteration at a time, like any other loop
+    with monkeypatch.context() as patch:
+        patch.setattr(API.Loopable, "is_deterministic", lambda self: False)
+        per_iteration = parse(SCRIPTS[name], f"{name}_per_iteration")
+
+    assert len(per_iteration.periodic) == 0
+    assert frame_states(periodic) == frame_states(per_iteration)
+
+@pytest.mark.parametrize("window", [(0, 5), (3, 40), (17, 18), (50, 400)])
+def test_windows_match_the_full_timeline(parse, window):
+    temporal_dict = parse(SCRIPTS["sequences"])
+    states = list(temporal_dict.states_generator())
+
+    assert list(temporal_dict.states_generator(*window)) == states[window[0]:window[1]]
+
+def test_long_loops_compile_to_one_run_each(parse):
+    temporal_dict = parse('''
+def main():
+    settings = {"g%d" % group: ["0", "1", "2", "3"] for group in range(4)}
+    at = AnimTools(settings).init_with_first()
+    for group in range(4):
+        at.sequence("s%d" % group).pulse("g%d" % group, 20 + group * 7, hold_time=40).loop_background()
+    wait(3600 * 1000)
+''')
+
+    assert len(temporal_dict.periodic) == 4
+    assert sum(run.count for run in temporal_dict.periodic) > 4 * 3600 * 1000 // 300
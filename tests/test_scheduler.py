@@ -0,0 +1,92 @@
+from conftest import frame_states
+
+SETTINGS = '''
+    settings = {"a": ["0", "1", "2", "3"], "b": ["0", "1", "2"], "c": ["x", "y", "z"]}
+    at = AnimTools(settings).init_with_first()
+    at.sequence("A").pulse("a", 40).add_action(lambda: set_state("b", "2"))
+    at.sequence("B").cycle("b", 55)
+    at.sequence("C").transition("c", 0, 2, 70)
+'''
+
+def script(body):
+    return "def main():" + SETTINGS + body
+
+def test_stopping_at_an_earlier_target_after_a_later_one(parse):
+    #C's stop runs A past 1000, A's own stop must still end it there
+    later_first = parse(script('''
+    for name in "ABC":
+        at.sequence(name).loop_background()
+    wait(2000)
+    at.sequence("C").stop()
+    at.sequence("A").stop(target=1000, should_wait=False)
+    at.sequence("B").stop()
+    wait(300)
+'''))
+
+    in_order = parse(script('''
+    for name in "ABC":
+        at.sequence(name).loop_background()
+    wait(2000)
+    at.sequence("A").stop(target=1000, should_wait=False)
+    at.sequence("C").stop()
+    at.sequence("B").stop()
+    wait(300)
+'''))
+
+    assert later_first.to_events() == in_order.to_events()
+    assert frame_states(later_first) == frame_states(in_order)
+
+    #A's iterations take 240ms, the last one starts at 960
+    assert max(time for time, options in later_first.to_events() if "a" in options) < 1200
+
+def test_replace_at_an_earlier_target_continues_where_the_loop_ended(parse):
+    temporal_dict = parse(script('''
+    at.sequence("A").loop_background()
+    at.sequence("C").loop_background()
+    wait(2000)
+    at.sequence("C").stop()
+    at.sequence("A").replace("B", target=1000)
+    wait(500)
+'''))
+
+    a_times = [time for time, options in temporal_dict.to_events() if "a" in options]
+    b_times = [time for time, options in temporal_dict.to_events() if time > 0 and options.get("b") in ("0", "1")]
+
+    assert max(a_times) < 1000 + 6 * 40
+    assert min(b_times) > max(a_times)
+
+def test_loops_writing_one_setting_at_once_resolve_in_stop_order(parse):
+    source = '''
+def main():
+    settings = {{"a": ["0", "1", "2", "3"]}}
+    at = AnimTools(settings).init_with_first()
+    at.sequence("up").add_action(lambda: set_state("a", "1")).wait(50)
+    at.sequence("down").add_action(lambda: set_state("a", "2")).wait(50)
+    at.sequence("up").loop_background()
+    at.sequence("down").loop_background()
+    wait(500)
+    at.sequence("{first}").stop()
+    at.sequence("{last}").stop()
+'''
+
+    up_last = parse(source.format(first="down", last="up"), "up_last")
+    down_last = parse(source.format(first="up", last="down"), "down_last")
+
+    assert {options["a"] for _, options in up_last.to_events()} == {"1"}
+    assert {options["a"] for _, options in down_last.to_events()} == {"2"}
+
+def test_loops_still_running_at_the_end_stop_in_the_order_they_started(parse):
+    source = '''
+def main():
+    settings = {"a": ["0", "1", "2", "3"]}
+    at = AnimTools(settings).init_with_first()
+    at.sequence("up").add_action(lambda: set_state("a", "1")).wait(50)
+    at.sequence("down").add_action(lambda: set_state("a", "2")).wait(50)
+    at.sequence("up").loop_background()
+    at.sequence("down").loop_background()
+    wait(500)
+'''
+
+    #stopping implicitly at the end of main() writes the loop started last over the first one
+    for attempt in range(3):
+        assert {options["a"] for _, options in parse(source, f"run{attempt}").to_events()} == {"2"}
@@ -0,0 +1,123 @@
+import json
+
+import cv2
+import numpy as np
+
+from psd_tools.constants import SectionDivider
+from psd_tools.psd import PSD
+from psd_tools.psd.header import FileHeader
+from psd_tools.psd.image_data import ImageData
+from psd_tools.psd.image_resources import ImageResources
+from psd_tools.psd.layer_and_mask import ChannelImageData, LayerAndMaskInformation, LayerInfo, LayerRecords
+
+from AutoAnim import getArgs, main
+from Benchmark import layer_record
+from Sinks import TextureSink
+from State import State
+
+WIDTH, HEIGHT = 40, 30
+
+#the two options of group0 only cover these boxes, everything else is background
+OPTION_BOXES = {"0": (8, 4, 24, 20), "1": (16, 8, 32, 24)}
+REGION = (8, 4, 32, 24)
+
+def texture_args(tmp_path, *extra):
+    return getArgs(["-s", str(tmp_path / "scene.py"), "-i", str(tmp_path / "cache"), "--texture-layout", "horizontal", *extra])
+
+def solid(value):
+    return np.full((HEIGHT, WIDTH, 3), value, np.uint8)
+
+def test_dedupe_sidecar_maps_frames_to_tiles(tmp_path):
+    first, second, third = (State({"group0": option}) for option in "012")
+    states = [first, first, second, first, third, third, third, second]
+    colours = {first: 10, second: 20, third: 30}
+
+    path = tmp_path / "atlas.png"
+    sink = TextureSink(texture_args(tmp_path, "--texture-dedupe"), path, len(states), states)
+
+    for state in states:
+        sink.add(state, solid(colours[state]))
+
+    sink.close()
+
+    sidecar = json.loads(path.with_suffix(".json").read_text())
+
+    assert sidecar["tile_count"] == 3 and sidecar["frame_count"] == len(states)
+    assert [(entry["frame"], entry["tile"]) for entry in sidecar["frames"]] == [(0, 0), (2, 1), (3, 0), (4, 2), (7, 1)]
+
+    #every frame's tile holds the pixels of its state
+    atlas = cv2.imread(str(path))
+
+    assert atlas.shape == (HEIGHT, WIDTH * 3, 3)
+
+    for entry in sidecar["frames"]:
+        tile = atlas[:, entry["tile"] * WIDTH:(entry["tile"] + 1) * WIDTH]
+        assert np.all(tile == colours[states[entry["frame"]]])
+
+def build_trim_psd(path):
+    '''An opaque background with group0 of two opaque options inside REGION'''
+
+    def rectangle(name, bbox, colour, visible=True):
+        left, top, right, bottom = bbox
+
+        pixels = np.full((bottom - top, right - left, 4), 255, np.uint8)
+        pixels[..., :3] = colour
+
+        return layer_record(name, bbox, pixels, visible=visible)
+
+    records = [
+        rectangle("background", (0, 0, WIDTH, HEIGHT), (40, 40, 40)),
+        layer_record("</Layer group>", divider=SectionDivider.BOUNDING_SECTION_DIVIDER),
+        rectangle("0", OPTION_BOXES["0"], (200, 0, 0)),
+        rectangle("1", OPTION_BOXES["1"], (0, 200, 0), visible=False),
+        layer_record("group0", divider=SectionDivider.OPEN_FOLDER),
+    ]
+
+    layer_info = LayerInfo(
+        layer_count=len(records),
+        layer_records=LayerRecords([record for record, _ in records]),
+        channel_image_data=ChannelImageData([channels for _, channels in records])
+    )
+
+    header = FileHeader(width=WIDTH, height=HEIGHT, depth=8, channels=3, color_mode=3)
+
+    psd = PSD(
+        header=header,
+        image_data=ImageData.new(header),
+        image_resources=ImageResources.new(),
+        layer_and_mask_information=LayerAndMaskInformation(layer_info=layer_info)
+    )
+
+    with open(path, "wb") as file:
+        psd.write(file)
+
+def test_trimmed_atlas_holds_only_the_changing_region(tmp_path):
+    psd_path = tmp_path / "trim.psd"
+    build_trim_psd(psd_path)
+
+    script_path = tmp_path / "scene.py"
+    script_path.write_text('''
+def main():
+    at = AnimTools({"group0": ["0", "1"]}).init_with_first()
+    at.sequence("blink").cycle("group0", 100).loop_background()
+    wait(400)
+''')
+
+    main(getArgs([
+        "-p", str(psd_path), "-s", str(script_path), "-i", str(tmp_path / "cache"),
+        "-t", "-o", str(tmp_path / "atlas.png"), "--texture-trim", "--texture-layout", "horizontal", "--fps", "10",
+    ]))
+
+    sidecar = json.loads((tmp_path / "atlas.json").read_text())
+    left, top, right, bottom = REGION
+
+    assert sidecar["region"] == {"x": left, "y": top, "width": right - left, "height": bottom - top}
+
+    base = cv2.imread(str(tmp_path / sidecar["base"]))
+    atlas = cv2.imread(str(tmp_path / "atlas.png"))
+
+    assert base.shape == (HEIGHT, WIDTH, 3)
+    assert atlas.shape == (bottom - top, (right - left) * sidecar["tile_count"], 3)
+
+    #the first tile is the first frame cropped to the region, which lies at the region's offset in the base image
+    assert np.array_equal(atlas[:, :right - left], base[top:bottom, left:right])
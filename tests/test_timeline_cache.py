@@ -0,0 +1,128 @@
+from AutoAnim import getArgs
+from ScriptParser import ScriptParser
+
+from conftest import frame_states
+
+SCRIPT = '''
+def main():
+    settings = {"group0": ["0", "1", "2"], "group1": ["0", "1", "2"]}
+
+    at = AnimTools(settings).init_with_first()
+    at.sequence("pulse").pulse("group0", 100).loop_background()
+    at.sequence("blink").set("group1", "1").wait(70).set("group1", "0").wait(90).loop_background()
+
+    wait(2000)
+'''
+
+RANDOM_SCRIPT = '''
+def main():
+    settings = {"group0": ["0", "1", "2"]}
+
+    at = AnimTools(settings).init_with_first()
+    at.sequence("flicker").random("group0").wait(40).loop_background()
+
+    wait(2000)
+'''
+
+TIME_SCRIPT = '''
+from time import time as clock
+
+def main():
+    settings = {"group0": ["0", "1", "2"]}
+
+    at = AnimTools(settings).init_with_first()
+    wait(1000 + int(clock()) % 2)
+'''
+
+HELPER_SCRIPT = '''
+from helper import OPTION
+
+def main():
+    settings = {"group0": ["0", "1", "2"]}
+
+    at = AnimTools(settings).init_with_first()
+    wait(100)
+    set_state("group0", OPTION)
+    wait(100)
+'''
+
+def parser(tmp_path, source, *extra):
+    script_path = tmp_path / "scene.py"
+    script_path.write_text(source)
+
+    return ScriptParser(getArgs(["-s", str(script_path), "-i", str(tmp_path / "cache"), *extra]))
+
+def compiled_timelines(tmp_path):
+    return list((tmp_path / "cache" / "timelines").glob("*.json"))
+
+def test_round_trip(tmp_path):
+    compiled = parser(tmp_path, SCRIPT).parse_script()
+
+    assert len(compiled_timelines(tmp_path)) == 1
+
+    loaded_parser = parser(tmp_path, SCRIPT)
+    loaded = loaded_parser.timeline_cache.load(loaded_parser.script_path)
+
+    assert loaded is not None
+    assert frame_states(loaded) == frame_states(compiled)
+
+def test_load_file(tmp_path):
+    compiled = parser(tmp_path, SCRIPT).parse_script()
+    timeline_path, = compiled_timelines(tmp_path)
+
+    loaded = parser(tmp_path, SCRIPT, "--timeline", str(timeline_path)).parse_script()
+
+    assert frame_states(loaded) == frame_states(compiled)
+
+def test_edit_recompiles(tmp_path):
+    parser(tmp_path, SCRIPT).parse_script()
+
+    edited = parser(tmp_path, SCRIPT.replace("wait(2000)", "wait(3000)"))
+
+    assert edited.timeline_cache.load(edited.script_path) is None
+
+def test_random_script_not_cached(tmp_path):
+    script_parser = parser(tmp_path, RANDOM_SCRIPT)
+    script_parser.parse_script()
+
+    assert script_parser.volatile
+    assert compiled_timelines(tmp_path) == []
+
+def test_time_script_not_cached(tmp_path):
+    script_parser = parser(tmp_path, TIME_SCRIPT)
+    script_parser.parse_script()
+
+    assert script_parser.volatile
+    assert compiled_timelines(tmp_path) == []
+
+def test_no_timeline_cache(tmp_path):
+    parser(tmp_path, SCRIPT, "--no-timeline-cache").parse_script()
+
+    assert compiled_timelines(tmp_path) == []
+
+def test_same_script_in_other_directory(tmp_path):
+    '''Byte identical scripts importing different helpers next to them'''
+
+    compiled = {}
+
+    for directory, option in (("a", "1"), ("b", "2")):
+        (tmp_path / directory).mkdir()
+        (tmp_path / directory / "helper.py").write_text(f'OPTION = "{option}"\n')
+
+        script_path = tmp_path / directory / "scene.py"
+        script_path.write_text(HELPER_SCRIPT)
+
+        args = getArgs(["-s", str(script_path), "-i", str(tmp_path / "cache")])
+        compiled[directory] = frame_states(ScriptParser(args).parse_script())
+
+    assert compiled["a"] != compiled["b"]
+    assert len(compiled_timelines(tmp_path)) == 2
+
+def test_editing_an_imported_helper_recompiles(tmp_path):
+    (tmp_path / "helper.py").write_text('OPTION = "1"\n')
+    parser(tmp_path, HELPER_SCRIPT).parse_script()
+
+    (tmp_path / "helper.py").write_text('OPTION = "2"\n')
+    edited = parser(tmp_path, HELPER_SCRIPT)
+
+    assert edited.timeline_cache.load(edited.script_path) is None
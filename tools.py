@@ -28,7 +28,6 @@ class AnimTools:
 
         def make_looper(self):
 
-            @Loopable
             def looper():
                 if len(self.actions) == 0:
                     raise EmptySequenceError(f"sequence '{self.name}' is empty. Did you mistype the name?")
@@ -42,7 +41,11 @@ class AnimTools:
                 for action in self.actions:
                     action()
 
-            return looper
+            return Loopable(looper, deterministic=self.is_deterministic)
+
+        def is_deterministic(self):
+            '''Whether the next run only sets states and waits, the same way as every run after it'''
+            return not self.run_preactions and len(self.actions) != 0 and all(is_deterministic(action) for action in self.actions)
 
         def use_pre_actions(self, value=True):
             self.run_preactions = value
@@ -81,11 +84,11 @@ class AnimTools:
             return self
 
         def wait(self, time):
-            self.actions.append(lambda: wait(time))
+            self.actions.append(Loopable(lambda: wait(time), deterministic=True))
             return self
 
         def set(self, *args, **kwargs):
-            self.actions.append(lambda: self.parent.set(*args, **kwargs))
+            self.actions.append(Loopable(lambda: self.parent.set(*args, **kwargs), deterministic=True))
             return self
 
         def run_sequence(self, sequence_name):
@@ -156,6 +159,7 @@ class AnimTools:
 
             wait(down_time)
 
+        cycler.deterministic = True
         self.loopers.append(cycler)
 
         return cycler
@@ -175,7 +179,8 @@ class AnimTools:
                 wait(frame_time)
 
             wait(down_time)
-        
+
+        pulser.deterministic = True
         self.loopers.append(pulser)
 
         return pulser
@@ -197,6 +202,7 @@ class AnimTools:
 
                 wait(frame_time)
 
+        transitioner.deterministic = True
         self.loopers.append(transitioner)
 
         return transitioner
@@ -268,6 +274,13 @@ class AnimTools:
         self.settings[alias] = self.settings[setting]
         return self
 
+def is_deterministic(action):
+    '''Whether a sequence action declares it only sets states and waits, plain functions never do'''
+
+    check = getattr(action, "is_deterministic", None)
+
+    return check is not None and check()
+
 def pairs(iterable):
     items = tuple(iterable)
 